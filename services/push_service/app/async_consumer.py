@@ -0,0 +1,147 @@
+import os
+import asyncio
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
+from loguru import logger
+
+from app.redis_client import init_redis, close_redis
+from app.consumer import process_message, RABBITMQ_URL, QUEUE_NAME, PREFETCH_COUNT
+from app.retry_queues import (
+    Publication,
+    retry_topology,
+    plan_failure,
+    record_queue_depths,
+    PARKING_QUEUE_NAME,
+    RETRY_BACKLOG_POLL_SECONDS,
+)
+from app.webpush_client import close_webpush_transport
+from app.user_client import close_user_client
+from app.status_writer import close_status_writer
+from app.metrics import observe_end_to_end
+
+# Seconds to wait before retrying the initial connection
+RECONNECT_DELAY = float(os.getenv("RABBITMQ_RECONNECT_DELAY", "5"))
+
+
+# Publish a retry/parked body through the default exchange and wait for the broker's confirm
+def make_publisher(channel: AbstractChannel):
+    async def publish(publication: Publication):
+        message = aio_pika.Message(
+            publication.body,
+            content_type=publication.content_type,
+            content_encoding=publication.content_encoding,
+            delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        )
+        await channel.default_exchange.publish(message, routing_key=publication.routing_key)
+    return publish
+
+
+# Handle a single delivery: process, hand any retry to the broker, then ack on the event loop
+async def handle_message(redis, message: AbstractIncomingMessage, publish):
+    msg = None
+    try:
+        msg, republish = await process_message(redis, message.body, message.content_type, message.content_encoding)
+    except Exception as e:
+        logger.error(f" Error processing message: {e}")
+        republish = [plan_failure(message.body, str(e), message.content_type, message.content_encoding)]
+
+    try:
+        for publication in republish:
+            await publish(publication)
+            if publication.routing_key == PARKING_QUEUE_NAME:
+                logger.warning(f" Message parked on '{PARKING_QUEUE_NAME}'")
+        await message.ack()
+    except Exception as e:
+        logger.error(f" Could not publish retry: {e}")
+        try:
+            await message.nack(requeue=True)
+        except Exception as nack_error:
+            # Channel went away; the broker redelivers unacked messages on its own
+            logger.warning(f" Could not nack message: {nack_error}")
+        return
+    if msg is not None:
+        observe_end_to_end(msg.published_at)
+
+
+async def poll_retry_backlog(channel: AbstractChannel):
+    """Periodically read tier and parking queue depths into the backlog gauges."""
+    while True:
+        try:
+            depths = {}
+            for name, _ in retry_topology():
+                queue = await channel.declare_queue(name, passive=True)
+                depths[name] = queue.declaration_result.message_count
+            record_queue_depths(depths)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f" Could not read retry queue depths: {e}")
+        await asyncio.sleep(RETRY_BACKLOG_POLL_SECONDS)
+
+
+async def run_async_consumer(stop_event: asyncio.Event | None = None):
+    """
+    Consume the push queue on a single event loop.
+    Up to RABBITMQ_PREFETCH messages are processed concurrently; the robust
+    connection reconnects and re-subscribes without blocking the loop.
+    """
+    stop_event = stop_event or asyncio.Event()
+    redis = await init_redis()
+    in_flight: set[asyncio.Task] = set()
+
+    while not stop_event.is_set():
+        connection = None
+        backlog_poller = None
+        try:
+            logger.info("🔌 Connecting to RabbitMQ (asyncio)...")
+            connection = await aio_pika.connect_robust(RABBITMQ_URL, heartbeat=30)
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=PREFETCH_COUNT)
+            queue = await channel.declare_queue(QUEUE_NAME, durable=True)
+            for name, arguments in retry_topology():
+                await channel.declare_queue(name, durable=True, arguments=arguments)
+            publish = make_publisher(channel)
+            backlog_poller = asyncio.create_task(poll_retry_backlog(channel))
+
+            async def on_message(message: AbstractIncomingMessage):
+                task = asyncio.create_task(handle_message(redis, message, publish))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+            consumer_tag = await queue.consume(on_message)
+            logger.info(f" Async Web Push consumer started on '{QUEUE_NAME}' (prefetch={PREFETCH_COUNT})")
+
+            await stop_event.wait()
+
+            # Stop new deliveries, then let in-flight messages finish and ack
+            await queue.cancel(consumer_tag)
+            if in_flight:
+                logger.info(f" Draining {len(in_flight)} in-flight message(s)...")
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            logger.warning(f" RabbitMQ async consumer error: {e}, retrying in {RECONNECT_DELAY} seconds...")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=RECONNECT_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+        finally:
+            if backlog_poller is not None:
+                backlog_poller.cancel()
+            if connection and not connection.is_closed:
+                await connection.close()
+                logger.info(" Connection closed cleanly.")
+
+    await close_user_client()
+    await close_webpush_transport()
+    await close_status_writer()
+    await close_redis()
+
+
+def start_async_consumer():
+    """Thread entry point: run the asyncio consumer on its own event loop."""
+    asyncio.run(run_async_consumer())
@@ -0,0 +1,204 @@
+import os
+import threading
+from typing import NamedTuple
+
+import orjson
+import msgpack
+import zstandard
+
+# Wire formats, chosen by the AMQP content_type; anything that is not msgpack is JSON
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = frozenset({MSGPACK, "application/x-msgpack", "application/vnd.msgpack"})
+# AMQP content_encoding for compressed bodies
+ZSTD = "zstd"
+
+# Encoded bodies at least this large are zstd-compressed (0 = never); large device lists compress well
+MESSAGE_ZSTD_MIN_BYTES = int(os.getenv("MESSAGE_ZSTD_MIN_BYTES", "65536"))
+MESSAGE_ZSTD_LEVEL = int(os.getenv("MESSAGE_ZSTD_LEVEL", "3"))
+# Compressed bodies may not expand beyond this
+MESSAGE_MAX_BYTES = int(os.getenv("MESSAGE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# zstd contexts are not thread-safe; the blocking consumer and the API loop run on different threads
+_zstd = threading.local()
+
+
+class MessageDecodeError(ValueError):
+    """The body cannot be decoded or is not a valid push message; retrying will not help."""
+
+
+class EncodedMessage(NamedTuple):
+    body: bytes
+    content_type: str
+    content_encoding: str | None
+
+
+# (wire key, attribute, accepted types, required). Checked in order by PushMessage.from_dict.
+_FIELDS = (
+    ("notification_id", "notification_id", (str,), True),
+    ("user_id", "user_id", (str,), False),
+    ("title", "title", (str,), False),
+    ("body", "body", (str,), False),
+    ("action_url", "action_url", (str,), False),
+    ("publishedAt", "published_at", (str,), False),
+    ("attempt", "attempt", (int,), False),
+    ("sent", "sent", (bool,), False),
+    ("last_error", "last_error", (str,), False),
+)
+_KNOWN_KEYS = frozenset(key for key, *_ in _FIELDS) | {"devices"}
+
+
+def _device_error(index: int, device) -> str | None:
+    if not isinstance(device, dict) or not isinstance(device.get("endpoint"), str):
+        return f"devices[{index}] needs a string endpoint"
+    keys = device.get("keys")
+    if not isinstance(keys, dict) or not isinstance(keys.get("p256dh"), str) or not isinstance(keys.get("auth"), str):
+        return f"devices[{index}] needs keys.p256dh and keys.auth"
+    return None
+
+
+def _validate_devices(devices) -> list[dict]:
+    if devices is None:
+        return []
+    if type(devices) is not list:
+        raise MessageDecodeError("devices must be a list")
+    # Fast path: exact type checks, no per-device error bookkeeping (decoders only produce plain dict/str)
+    try:
+        for device in devices:
+            keys = device["keys"]
+            if type(device["endpoint"]) is not str or type(keys["p256dh"]) is not str or type(keys["auth"]) is not str:
+                break
+        else:
+            return devices
+    except (KeyError, TypeError):
+        pass
+    for index, device in enumerate(devices):
+        error = _device_error(index, device)
+        if error:
+            raise MessageDecodeError(error)
+    return devices
+
+
+class PushMessage:
+    """
+    A validated push.queue message. Fields the consumer does not use
+    (e.g. gateway metadata) are kept in `extra` and written back out
+    unchanged when the message is retried.
+    """
+
+    __slots__ = (
+        "notification_id", "user_id", "devices", "title", "body", "action_url",
+        "published_at", "attempt", "sent", "last_error", "extra",
+    )
+
+    def __init__(
+        self,
+        notification_id: str,
+        devices: list[dict],
+        user_id: str | None = None,
+        title: str | None = None,
+        body: str | None = None,
+        action_url: str | None = None,
+        published_at: str | None = None,
+        attempt: int = 0,
+        sent: bool = False,
+        last_error: str | None = None,
+        extra: dict | None = None,
+    ):
+        self.notification_id = notification_id
+        self.devices = devices
+        self.user_id = user_id
+        self.title = title
+        self.body = body
+        self.action_url = action_url
+        self.published_at = published_at
+        self.attempt = attempt
+        self.sent = sent
+        self.last_error = last_error
+        self.extra = extra or {}
+
+    @classmethod
+    def from_dict(cls, data) -> "PushMessage":
+        if not isinstance(data, dict):
+            raise MessageDecodeError("message must be an object")
+        values = {}
+        for key, attr, types, required in _FIELDS:
+            value = data.get(key)
+            if value is None:
+                if required:
+                    raise MessageDecodeError(f"{key} is required")
+                continue
+            # bool is an int subclass; an attempt count of True is not valid
+            if not isinstance(value, types) or (types == (int,) and isinstance(value, bool)):
+                raise MessageDecodeError(f"{key} must be {types[0].__name__}")
+            values[attr] = value
+        if values.get("attempt", 0) < 0:
+            raise MessageDecodeError("attempt must not be negative")
+        values["devices"] = _validate_devices(data.get("devices"))
+        values["extra"] = {key: value for key, value in data.items() if key not in _KNOWN_KEYS}
+        return cls(**values)
+
+    def to_dict(self) -> dict:
+        data = dict(self.extra)
+        data["notification_id"] = self.notification_id
+        data["devices"] = self.devices
+        for key, attr, _, _ in _FIELDS[1:]:
+            value = getattr(self, attr)
+            if value is not None and (attr not in ("attempt", "sent") or value):
+                data[key] = value
+        return data
+
+    def replace(self, **changes) -> "PushMessage":
+        """Copy with some fields changed."""
+        values = {attr: getattr(self, attr) for attr in self.__slots__}
+        values.update(changes)
+        return PushMessage(**values)
+
+
+def _compressor() -> zstandard.ZstdCompressor:
+    compressor = getattr(_zstd, "compressor", None)
+    if compressor is None:
+        compressor = _zstd.compressor = zstandard.ZstdCompressor(level=MESSAGE_ZSTD_LEVEL)
+    return compressor
+
+
+def _decompressor() -> zstandard.ZstdDecompressor:
+    decompressor = getattr(_zstd, "decompressor", None)
+    if decompressor is None:
+        decompressor = _zstd.decompressor = zstandard.ZstdDecompressor()
+    return decompressor
+
+
+def is_msgpack(content_type: str | None) -> bool:
+    return bool(content_type) and content_type.split(";", 1)[0].strip().lower() in MSGPACK_TYPES
+
+
+def decode_message(body: bytes, content_type: str | None = None, content_encoding: str | None = None) -> PushMessage:
+    """Decode and validate a queue body. Raises MessageDecodeError for anything malformed."""
+    if content_encoding:
+        if content_encoding.lower() != ZSTD:
+            raise MessageDecodeError(f"unsupported content encoding: {content_encoding}")
+        try:
+            # max_output_size only applies to frames without a declared content size
+            if zstandard.frame_content_size(body) > MESSAGE_MAX_BYTES:
+                raise MessageDecodeError(f"zstd body larger than {MESSAGE_MAX_BYTES} bytes")
+            body = _decompressor().decompress(body, max_output_size=MESSAGE_MAX_BYTES)
+        except zstandard.ZstdError as e:
+            raise MessageDecodeError(f"invalid zstd body: {e}") from None
+    try:
+        data = msgpack.unpackb(body, raw=False) if is_msgpack(content_type) else orjson.loads(body)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise MessageDecodeError(f"undecodable body: {e}") from None
+    return PushMessage.from_dict(data)
+
+
+def encode_message(message: PushMessage | dict, content_type: str | None = JSON) -> EncodedMessage:
+    """Encode for the queue in `content_type` (JSON by default), zstd-compressed when large."""
+    data = message.to_dict() if isinstance(message, PushMessage) else message
+    if is_msgpack(content_type):
+        body, content_type = msgpack.packb(data, use_bin_type=True), MSGPACK
+    else:
+        body, content_type = orjson.dumps(data), JSON
+    if MESSAGE_ZSTD_MIN_BYTES and len(body) >= MESSAGE_ZSTD_MIN_BYTES:
+        return EncodedMessage(_compressor().compress(body), content_type, ZSTD)
+    return EncodedMessage(body, content_type, None)
@@ -0,0 +1,96 @@
+import os
+import time
+from datetime import datetime, timezone
+from prometheus_client import (
+    Counter,
+    Gauge,
+    Histogram,
+    CollectorRegistry,
+    REGISTRY,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+    multiprocess,
+)
+
+# With CONSUMER_PROCESSES > 1 every worker writes its samples here and /metrics aggregates them.
+# Must point at an empty directory when the service starts.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Fast in-process stages (decode, Redis flush)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Network and end-to-end latencies
+SLOW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+DECODE_SECONDS = Histogram(
+    "push_message_decode_seconds", "Time to decode a queue message body", buckets=FAST_BUCKETS
+)
+SEND_SECONDS = Histogram(
+    "push_send_seconds", "Web push request time per attempt", ["origin", "status"], buckets=SLOW_BUCKETS
+)
+STATUS_WRITE_SECONDS = Histogram(
+    "push_status_write_seconds", "Time to flush buffered notification status to Redis", buckets=FAST_BUCKETS
+)
+STATUS_DROPPED = Counter(
+    "push_status_dropped_total", "Buffered status keys dropped without being written to Redis", ["reason"]
+)
+END_TO_END_SECONDS = Histogram(
+    "push_end_to_end_seconds", "Time from publishedAt (gateway) to ack", buckets=SLOW_BUCKETS
+)
+DEVICES = Counter("push_devices_total", "Device delivery outcomes", ["outcome"])
+MESSAGES_IN_FLIGHT = Gauge(
+    "push_messages_in_flight", "Queue messages being processed", multiprocess_mode="livesum"
+)
+# Queue depths polled from the broker; every worker sees the same value, so take the max
+RETRY_BACKLOG = Gauge(
+    "push_retry_backlog", "Messages waiting in the delay-tier retry queues", multiprocess_mode="livemax"
+)
+PARKED_MESSAGES = Gauge(
+    "push_parked_messages", "Messages in the parking queue after exhausting retries", multiprocess_mode="livemax"
+)
+
+# Per push service origin; each worker process keeps its own breakers
+ORIGIN_BREAKER_STATE = Gauge(
+    "push_origin_breaker_state", "Circuit breaker state per origin (0 closed, 1 half-open, 2 open)", ["origin"],
+    multiprocess_mode="livemax",
+)
+ORIGIN_DEFERRED = Counter(
+    "push_origin_deferred_total", "Sends deferred to a retry tier without being attempted", ["origin", "reason"]
+)
+PUBLISH_SECONDS = Histogram(
+    "push_publish_seconds", "Time from publish to broker confirm (API process publisher)", ["outcome"],
+    buckets=(0.001, 0.0025) + SLOW_BUCKETS,
+)
+SCHEDULED_PENDING = Gauge(
+    "push_scheduled_pending", "Scheduled notifications not yet due or claimed", multiprocess_mode="livemax"
+)
+SCHEDULER_LAG_SECONDS = Histogram(
+    "push_scheduler_lag_seconds", "Time from a scheduled notification's due time to its publish", buckets=SLOW_BUCKETS
+)
+
+
+def observe_end_to_end(published_at: str | None):
+    """Record publish-to-ack time for a message carrying the gateway's `publishedAt` timestamp."""
+    if not published_at:
+        return
+    try:
+        published = datetime.fromisoformat(published_at.replace("Z", "+00:00"))
+    except (TypeError, ValueError):
+        return
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=timezone.utc)
+    END_TO_END_SECONDS.observe(max(0.0, time.time() - published.timestamp()))
+
+
+def mark_process_dead(pid: int):
+    """Drop a dead worker's live gauges from the multiprocess aggregate."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus text exposition of this process (or of every worker in multiprocess mode)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
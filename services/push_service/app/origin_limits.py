@@ -0,0 +1,164 @@
+import os
+import time
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import pybreaker
+from pywebpush import WebPushException
+from loguru import logger
+
+from app.metrics import ORIGIN_BREAKER_STATE, ORIGIN_DEFERRED
+
+# Token bucket per push service origin, per process (0 = no rate limit)
+WEBPUSH_ORIGIN_RATE = float(os.getenv("WEBPUSH_ORIGIN_RATE", "1000"))
+WEBPUSH_ORIGIN_BURST = int(os.getenv("WEBPUSH_ORIGIN_BURST", "200"))
+# Longest a send waits for its token; beyond that the device is deferred to a retry tier
+WEBPUSH_RATE_MAX_WAIT_MS = float(os.getenv("WEBPUSH_RATE_MAX_WAIT_MS", "500"))
+
+# Pause after a 429/503: Retry-After when given, else the default; capped
+WEBPUSH_RETRY_AFTER_DEFAULT = float(os.getenv("WEBPUSH_RETRY_AFTER_DEFAULT", "5"))
+WEBPUSH_RETRY_AFTER_MAX = float(os.getenv("WEBPUSH_RETRY_AFTER_MAX", "600"))
+
+# Consecutive failures (5xx, timeouts, connection errors) that open an origin's breaker,
+# and seconds before a half-open trial send is let through
+WEBPUSH_BREAKER_FAIL_MAX = int(os.getenv("WEBPUSH_BREAKER_FAIL_MAX", "10"))
+WEBPUSH_BREAKER_RESET_TIMEOUT = float(os.getenv("WEBPUSH_BREAKER_RESET_TIMEOUT", "30"))
+
+BREAKER_STATE_VALUES = {pybreaker.STATE_CLOSED: 0, pybreaker.STATE_HALF_OPEN: 1, pybreaker.STATE_OPEN: 2}
+THROTTLE_STATUSES = {429, 503}
+
+
+class OriginUnavailable(Exception):
+    """A send was not attempted: the origin's breaker is open or it is rate limited."""
+
+    def __init__(self, origin: str, reason: str):
+        super().__init__(f"{origin} unavailable ({reason}), send deferred")
+        self.origin = origin
+        self.reason = reason
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Sends per second with a burst allowance, plus a hard pause set from Retry-After."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self, max_wait: float) -> float | None:
+        """
+        Take a token and return how long to wait before using it, or None
+        (nothing taken) when that would be longer than `max_wait`.
+        Tokens can go negative, so waiting callers are served in order.
+        """
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        wait = max(0.0, self.paused_until - now)
+        if self.rate > 0 and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        if self.rate > 0:
+            self.tokens -= 1
+        return wait
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def _is_origin_healthy_response(exc: BaseException) -> bool:
+    """Excluded from breaker failures: the origin answered, just not with a 2xx (4xx incl. 429)."""
+    if isinstance(exc, asyncio.CancelledError):
+        return True
+    return isinstance(exc, WebPushException) and exc.response is not None and exc.response.status_code < 500
+
+
+class _BreakerMetrics(pybreaker.CircuitBreakerListener):
+    def state_change(self, cb, old_state, new_state):
+        ORIGIN_BREAKER_STATE.labels(cb.name).set(BREAKER_STATE_VALUES.get(new_state.name, 0))
+        logger.warning(f" Circuit breaker for {cb.name}: {old_state.name if old_state else '-'} -> {new_state.name}")
+
+
+class OriginGuard:
+    """Rate limiter and circuit breaker for one push service origin."""
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.bucket = TokenBucket(WEBPUSH_ORIGIN_RATE, WEBPUSH_ORIGIN_BURST)
+        self.breaker = pybreaker.CircuitBreaker(
+            fail_max=WEBPUSH_BREAKER_FAIL_MAX,
+            reset_timeout=WEBPUSH_BREAKER_RESET_TIMEOUT,
+            exclude=[_is_origin_healthy_response],
+            listeners=[_BreakerMetrics()],
+            name=origin,
+            throw_new_error_on_trip=False,
+        )
+        ORIGIN_BREAKER_STATE.labels(origin).set(0)
+
+    def _defer(self, reason: str):
+        ORIGIN_DEFERRED.labels(self.origin, reason).inc()
+        return OriginUnavailable(self.origin, reason)
+
+    @contextlib.asynccontextmanager
+    async def sending(self):
+        """
+        Guard one send: waits briefly for a rate token, then runs the block
+        through the breaker. Raises OriginUnavailable instead of sending when
+        the origin is paused or its breaker is open.
+        """
+        wait = self.bucket.reserve(WEBPUSH_RATE_MAX_WAIT_MS / 1000)
+        if wait is None:
+            raise self._defer("rate_limited")
+        if wait:
+            await asyncio.sleep(wait)
+        try:
+            with self.breaker.calling():
+                yield
+        except pybreaker.CircuitBreakerError:
+            # Only raised on entry: with throw_new_error_on_trip=False failures re-raise as-is
+            raise self._defer("breaker_open") from None
+
+    def observe_response(self, response):
+        """Pause the origin after a 429/503, for Retry-After seconds when the push service sends it."""
+        if response is None or response.status_code not in THROTTLE_STATUSES:
+            return
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        seconds = min(WEBPUSH_RETRY_AFTER_MAX, WEBPUSH_RETRY_AFTER_DEFAULT if retry_after is None else retry_after)
+        self.bucket.pause(seconds)
+        logger.warning(f" {self.origin} returned {response.status_code}, pausing sends for {seconds:.0f}s")
+
+
+class OriginGuards:
+    """One OriginGuard per push service origin, created on first use."""
+
+    def __init__(self):
+        self._guards: dict[str, OriginGuard] = {}
+
+    def get(self, origin: str) -> OriginGuard:
+        guard = self._guards.get(origin)
+        if guard is None:
+            guard = self._guards[origin] = OriginGuard(origin)
+        return guard
@@ -54,3 +54,29 @@ async def close_redis():
             logger.warning(f" Failed to close Redis connection: {e}")
         finally:
             redis_client = None
+
+
+# The API process's own client (status reads, scheduler). The consumer thread's
+# redis_client above lives on that thread's event loop and cannot be shared.
+api_redis_client: Redis | None = None
+
+
+def get_api_redis() -> Redis:
+    """Lazily create the API process's Redis client on the server's event loop."""
+    global api_redis_client
+    if api_redis_client is None:
+        api_redis_client = Redis.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            decode_responses=True,
+            socket_timeout=5,
+            socket_connect_timeout=5,
+            health_check_interval=30,
+        )
+    return api_redis_client
+
+
+async def close_api_redis():
+    global api_redis_client
+    if api_redis_client is not None:
+        await api_redis_client.aclose()
+        api_redis_client = None
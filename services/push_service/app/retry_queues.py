@@ -0,0 +1,84 @@
+import os
+from typing import NamedTuple
+
+from app.codec import PushMessage, MessageDecodeError, decode_message, encode_message
+from app.metrics import RETRY_BACKLOG, PARKED_MESSAGES
+
+# Same queue the consumers read; retry tiers dead-letter back into it
+QUEUE_NAME = os.getenv("RABBITMQ_QUEUE_NAME", "push.queue")
+
+# Delay (ms) before each retry attempt; one TTL queue per tier.
+# A message that fails on the last tier goes to the parking queue.
+RETRY_DELAYS_MS = [int(delay) for delay in os.getenv("RETRY_DELAYS_MS", "5000,30000,120000").split(",") if delay.strip()]
+PARKING_QUEUE_NAME = os.getenv("RABBITMQ_PARKING_QUEUE", f"{QUEUE_NAME}.parking")
+
+# How often each consumer reads the tier queue depths into the retry backlog gauge
+RETRY_BACKLOG_POLL_SECONDS = float(os.getenv("RETRY_BACKLOG_POLL_SECONDS", "15"))
+
+
+class Publication(NamedTuple):
+    """A body to publish through the default exchange before the original delivery is acked."""
+    routing_key: str
+    body: bytes
+    content_type: str | None
+    content_encoding: str | None
+
+
+def retry_queue_name(delay_ms: int) -> str:
+    return f"{QUEUE_NAME}.retry.{delay_ms}ms"
+
+
+def retry_topology() -> list[tuple[str, dict | None]]:
+    """
+    (queue name, arguments) of every queue the consumers declare next to the
+    push queue. Tier messages expire after the tier delay and are dead-lettered
+    through the default exchange back onto QUEUE_NAME; nothing consumes them.
+    """
+    queues = [
+        (retry_queue_name(delay), {
+            "x-message-ttl": delay,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": QUEUE_NAME,
+        })
+        for delay in RETRY_DELAYS_MS
+    ]
+    queues.append((PARKING_QUEUE_NAME, None))
+    return queues
+
+
+def is_final_attempt(msg: PushMessage) -> bool:
+    """True when a failure of this delivery goes to the parking queue rather than another tier."""
+    return msg.attempt >= len(RETRY_DELAYS_MS)
+
+
+def plan_retry(
+    msg: PushMessage, devices: list, error: str | None = None, content_type: str | None = None, **changes
+) -> Publication:
+    """
+    Publication that retries `devices` of `msg`: to the next delay tier, or
+    the parking queue once every tier has been used. Only the given devices
+    are carried over, with the attempt count incremented, in the codec the
+    message arrived in.
+    """
+    attempt = msg.attempt + 1
+    if attempt <= len(RETRY_DELAYS_MS):
+        routing_key = retry_queue_name(RETRY_DELAYS_MS[attempt - 1])
+    else:
+        routing_key = PARKING_QUEUE_NAME
+    retry_msg = msg.replace(devices=devices, attempt=attempt, last_error=error[:500] if error else msg.last_error, **changes)
+    return Publication(routing_key, *encode_message(retry_msg, content_type))
+
+
+def plan_failure(body: bytes, error: str, content_type: str | None = None, content_encoding: str | None = None) -> Publication:
+    """Route a delivery that failed as a whole: undecodable or invalid bodies are parked as-is, the rest retried in full."""
+    try:
+        msg = decode_message(body, content_type, content_encoding)
+    except MessageDecodeError:
+        return Publication(PARKING_QUEUE_NAME, body, content_type, content_encoding)
+    return plan_retry(msg, msg.devices, error, content_type)
+
+
+def record_queue_depths(depths: dict[str, int]):
+    """Publish polled queue depths (name -> ready messages) to the backlog gauges."""
+    PARKED_MESSAGES.set(depths.get(PARKING_QUEUE_NAME, 0))
+    RETRY_BACKLOG.set(sum(count for name, count in depths.items() if name != PARKING_QUEUE_NAME))
@@ -0,0 +1,195 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+
+import orjson
+from redis.asyncio import Redis
+from loguru import logger
+
+from app.codec import PushMessage, MessageDecodeError, decode_message, encode_message
+from app.publisher import Publisher
+from app.status_writer import status_key, NOTIFICATION_STATUS_TTL
+from app.metrics import SCHEDULED_PENDING, SCHEDULER_LAG_SECONDS
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+# How often replicas look for due notifications, and how many one claim takes
+SCHEDULER_POLL_MS = int(os.getenv("SCHEDULER_POLL_MS", "500"))
+SCHEDULER_BATCH_SIZE = min(int(os.getenv("SCHEDULER_BATCH_SIZE", "500")), 5000)
+# A claimed batch not published within this many seconds is handed back to the due set
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", "60"))
+
+# Redis layout:
+#   scheduled:push          ZSET notification id -> due time (epoch ms)
+#   scheduled:push:claimed  ZSET notification id -> lease deadline (epoch ms)
+#   scheduled:push:payloads HASH notification id -> queue message (JSON)
+SCHEDULED_KEY = os.getenv("SCHEDULED_KEY", "scheduled:push")
+CLAIMED_KEY = f"{SCHEDULED_KEY}:claimed"
+PAYLOADS_KEY = f"{SCHEDULED_KEY}:payloads"
+
+# Move up to ARGV[2] due ids into the claimed set in one step, so no two
+# replicas get the same id. Returns flat [id, due_ms, payload, ...].
+_CLAIM_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, tonumber(ARGV[2]))
+local result = {}
+for i = 1, #items, 2 do
+    local id = items[i]
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+    result[#result + 1] = id
+    result[#result + 1] = items[i + 1]
+    result[#result + 1] = redis.call('HGET', KEYS[3], id) or ''
+end
+return result
+"""
+
+# Hand claims whose lease expired (publisher died) back to the due set, keeping them due now
+_RECOVER_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[1], id)
+end
+return #ids
+"""
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def parse_due_time(value) -> datetime:
+    """ISO-8601 `scheduledAt` (naive values are UTC) as an aware datetime."""
+    due = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return due if due.tzinfo else due.replace(tzinfo=timezone.utc)
+
+
+async def schedule_notification(redis: Redis, message: PushMessage, due: datetime) -> str:
+    """
+    Store `message` to be published at `due`.
+    O(log n); scheduling an id again replaces its payload and due time.
+    """
+    notification_id = message.notification_id
+    due_ms = int(due.timestamp() * 1000)
+    status_ttl = max(0, due_ms - _now_ms()) // 1000 + NOTIFICATION_STATUS_TTL
+
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(PAYLOADS_KEY, notification_id, orjson.dumps(message.to_dict()))
+        pipe.zadd(SCHEDULED_KEY, {notification_id: due_ms})
+        pipe.hset(status_key(notification_id), mapping={
+            "status": "scheduled",
+            "scheduled_at": due.isoformat(),
+            "updated_at": datetime.utcnow().isoformat(),
+        })
+        pipe.expire(status_key(notification_id), status_ttl)
+        await pipe.execute()
+    return notification_id
+
+
+async def cancel_scheduled(redis: Redis, notification_id: str) -> bool:
+    """Drop a notification that has not been claimed yet. Returns False if it was not pending."""
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.zrem(SCHEDULED_KEY, notification_id)
+        pipe.hdel(PAYLOADS_KEY, notification_id)
+        removed, _ = await pipe.execute()
+    if removed:
+        await redis.hset(status_key(notification_id), mapping={
+            "status": "cancelled", "updated_at": datetime.utcnow().isoformat(),
+        })
+    return bool(removed)
+
+
+class Scheduler:
+    """
+    Publishes due notifications onto the push queue. Any number of replicas
+    can run it: each batch is claimed atomically, and a batch whose
+    publisher dies is re-claimed once its lease expires (at-least-once).
+    """
+
+    def __init__(self, redis: Redis, publisher: Publisher, batch_size: int = SCHEDULER_BATCH_SIZE):
+        self.redis = redis
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self._claim = redis.register_script(_CLAIM_SCRIPT)
+        self._recover = redis.register_script(_RECOVER_SCRIPT)
+
+    async def run_once(self) -> int:
+        """Recover expired leases, then publish due batches until none is left. Returns messages published."""
+        now = _now_ms()
+        recovered = await self._recover(keys=[CLAIMED_KEY, SCHEDULED_KEY], args=[now, self.batch_size])
+        if recovered:
+            logger.warning(f" Scheduler recovered {recovered} claim(s) with expired leases")
+
+        published = 0
+        while True:
+            lease = _now_ms() + SCHEDULER_LEASE_SECONDS * 1000
+            items = await self._claim(
+                keys=[SCHEDULED_KEY, CLAIMED_KEY, PAYLOADS_KEY], args=[_now_ms(), self.batch_size, lease]
+            )
+            if not items:
+                break
+            published += await self._publish_batch(items)
+            if len(items) // 3 < self.batch_size:
+                break
+
+        SCHEDULED_PENDING.set(await self.redis.zcard(SCHEDULED_KEY))
+        return published
+
+    async def _publish_batch(self, items: list) -> int:
+        batch = [(items[i], int(float(items[i + 1])), items[i + 2]) for i in range(0, len(items), 3)]
+        released_at = datetime.now(timezone.utc).isoformat()
+
+        # Payloads cleared by a cancel between claim and publish, or undecodable, are not published
+        results: list[Exception | None] = [None] * len(batch)
+        to_publish, encoded = [], []
+        for index, (notification_id, _, payload) in enumerate(batch):
+            if not payload:
+                continue
+            try:
+                message = decode_message(payload.encode("utf8"))
+            except MessageDecodeError as e:
+                logger.error(f" Dropping scheduled notification {notification_id}: {e}")
+                continue
+            message.published_at = released_at
+            to_publish.append(index)
+            encoded.append(encode_message(message))
+
+        # One channel, confirms awaited together
+        for index, result in zip(to_publish, await self.publisher.publish_many(encoded)):
+            results[index] = result
+
+        # Unpublished claims stay in the claimed set and come back when their lease expires
+        done = [entry for entry, result in zip(batch, results) if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            logger.error(f" Scheduler failed to publish {len(errors)} notification(s): {errors[0]}")
+        if not done:
+            return 0
+
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrem(CLAIMED_KEY, *(notification_id for notification_id, _, _ in done))
+            pipe.hdel(PAYLOADS_KEY, *(notification_id for notification_id, _, _ in done))
+            for notification_id, due_ms, payload in done:
+                if payload:
+                    pipe.hset(status_key(notification_id), mapping={"status": "queued", "updated_at": datetime.utcnow().isoformat()})
+                    pipe.expire(status_key(notification_id), NOTIFICATION_STATUS_TTL)
+                    SCHEDULER_LAG_SECONDS.observe(max(0.0, now - due_ms / 1000))
+            await pipe.execute()
+        return sum(1 for _, _, payload in done if payload)
+
+    async def run(self, stop_event: asyncio.Event):
+        logger.info(f" Scheduler started on '{SCHEDULED_KEY}' (poll={SCHEDULER_POLL_MS}ms, batch={self.batch_size})")
+        while not stop_event.is_set():
+            try:
+                published = await self.run_once()
+                if published:
+                    logger.info(f" Scheduler published {published} due notification(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f" Scheduler error: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=SCHEDULER_POLL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
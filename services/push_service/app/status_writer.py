@@ -0,0 +1,323 @@
+import os
+import time
+import hashlib
+import asyncio
+from redis.asyncio import Redis
+from loguru import logger
+
+from app.metrics import STATUS_DROPPED, STATUS_WRITE_SECONDS
+
+# Status updates are flushed to Redis every N keys or every T ms, whichever comes first
+STATUS_FLUSH_SIZE = int(os.getenv("STATUS_FLUSH_SIZE", "100"))
+STATUS_FLUSH_MS = int(os.getenv("STATUS_FLUSH_MS", "50"))
+# A failed flush is retried on its own, backing off from STATUS_FLUSH_MS up to this
+STATUS_RETRY_MAX_MS = int(os.getenv("STATUS_RETRY_MAX_MS", "5000"))
+# Keys held while Redis is failing; a failed batch's keys beyond this are dropped (newer writes are kept)
+STATUS_MAX_PENDING_KEYS = int(os.getenv("STATUS_MAX_PENDING_KEYS", "10000"))
+
+# Notification status layout: a small counters hash plus a capped per-device outcome stream
+NOTIFICATION_STATUS_TTL = int(os.getenv("NOTIFICATION_STATUS_TTL", "86400"))
+RESULT_STREAM_MAXLEN = int(os.getenv("RESULT_STREAM_MAXLEN", "100"))
+RESULT_ERROR_MAX_CHARS = 200
+
+# Per-device completion markers, checked before each send so redeliveries only do the remaining work.
+# Must outlive redeliveries and the retry tiers.
+DELIVERY_CHECKPOINT_TTL = int(os.getenv("DELIVERY_CHECKPOINT_TTL", str(NOTIFICATION_STATUS_TTL)))
+# During a fan-out, finished devices are checkpointed every N devices or every T ms, whichever comes first,
+# so a consumer that dies mid fan-out only resends what was still unfinished
+DELIVERY_CHECKPOINT_BATCH_SIZE = int(os.getenv("DELIVERY_CHECKPOINT_BATCH_SIZE", "50"))
+DELIVERY_CHECKPOINT_FLUSH_MS = int(os.getenv("DELIVERY_CHECKPOINT_FLUSH_MS", "100"))
+
+
+def status_key(notification_id: str) -> str:
+    return f"notification:{notification_id}"
+
+
+def outcomes_key(notification_id: str) -> str:
+    return f"notification:{notification_id}:devices"
+
+
+def delivered_key(notification_id: str) -> str:
+    return f"notification:{notification_id}:delivered"
+
+
+def endpoint_digest(endpoint: str) -> str:
+    """Short fixed-size set member for a device endpoint (endpoints run to hundreds of bytes)."""
+    return hashlib.blake2b((endpoint or "").encode("utf8"), digest_size=10).hexdigest()
+
+
+class _PendingKey:
+    """Buffered writes for one Redis key."""
+
+    __slots__ = ("fields", "increments", "entries", "maxlen", "ttl")
+
+    def __init__(self):
+        self.fields: dict = {}
+        self.increments: dict[str, int] = {}
+        self.entries: list[dict] = []
+        self.maxlen: int | None = None
+        self.ttl: int | None = None
+
+
+class StatusWriter:
+    """
+    Write-behind buffer for notification status keys.
+    Updates from many in-flight messages are coalesced per key (hash fields:
+    last write wins, counters: summed, stream entries: capped) and flushed in one pipelined round trip, values and TTL together.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        flush_size: int = STATUS_FLUSH_SIZE,
+        flush_ms: int = STATUS_FLUSH_MS,
+        retry_max_ms: int = STATUS_RETRY_MAX_MS,
+        max_pending: int = STATUS_MAX_PENDING_KEYS,
+    ):
+        self._redis = redis
+        self._flush_size = max(1, flush_size)
+        self._flush_interval = flush_ms / 1000
+        self._retry_max = max(retry_max_ms, flush_ms) / 1000
+        self._max_pending = max(self._flush_size, max_pending)
+        self._pending: dict[str, _PendingKey] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+        # Consecutive failed flushes; while non-zero, flushes wait for the backoff timer
+        self._failures = 0
+
+    def _entry(self, key: str, ttl: int) -> _PendingKey:
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = _PendingKey()
+        entry.ttl = ttl
+        return entry
+
+    def hset(self, key: str, mapping: dict, ttl: int):
+        """Queue `HSET key mapping` + `EXPIRE key ttl`."""
+        self._entry(key, ttl).fields.update(mapping)
+        self._schedule()
+
+    def hincrby(self, key: str, field: str, amount: int, ttl: int):
+        """Queue `HINCRBY key field amount` + `EXPIRE key ttl`."""
+        increments = self._entry(key, ttl).increments
+        increments[field] = increments.get(field, 0) + amount
+        self._schedule()
+
+    def xadd(self, key: str, fields: dict, maxlen: int, ttl: int):
+        """Queue `XADD key MAXLEN ~ maxlen * fields` + `EXPIRE key ttl`."""
+        entry = self._entry(key, ttl)
+        entry.maxlen = maxlen
+        entry.entries.append(fields)
+        # Entries beyond maxlen would be trimmed by Redis anyway
+        if len(entry.entries) > maxlen:
+            del entry.entries[:-maxlen]
+        self._schedule()
+
+    def _schedule(self):
+        # While Redis is failing, a full buffer waits for the retry timer instead of flushing on every write
+        if len(self._pending) >= self._flush_size and not self._failures:
+            self._start_flush()
+        elif self._timer is None:
+            self._arm_timer()
+
+    def _arm_timer(self):
+        delay = min(self._retry_max, self._flush_interval * 2 ** self._failures)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._start_flush)
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: dict[str, _PendingKey]):
+        started = time.perf_counter()
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for key, entry in batch.items():
+                    if entry.fields:
+                        pipe.hset(key, mapping=entry.fields)
+                    for field, amount in entry.increments.items():
+                        pipe.hincrby(key, field, amount)
+                    for fields in entry.entries:
+                        pipe.xadd(key, fields, maxlen=entry.maxlen, approximate=True)
+                    if entry.ttl:
+                        pipe.expire(key, entry.ttl)
+                await pipe.execute()
+            STATUS_WRITE_SECONDS.observe(time.perf_counter() - started)
+            self._failures = 0
+        except Exception as e:
+            self._failures += 1
+            logger.error(f" Failed to flush {len(batch)} status key(s) to Redis (attempt {self._failures}): {e}")
+            self._requeue(batch)
+            # Retry on a backoff timer even if no new write arrives
+            if self._timer is None and self._pending:
+                self._arm_timer()
+
+    def _requeue(self, batch: dict[str, _PendingKey]):
+        """Merge a failed batch back under anything newer so the retry writes it, up to max_pending keys."""
+        dropped = 0
+        for key, failed in batch.items():
+            entry = self._pending.get(key)
+            if entry is None:
+                if len(self._pending) >= self._max_pending:
+                    dropped += 1
+                    continue
+                self._pending[key] = failed
+                continue
+            entry.fields = {**failed.fields, **entry.fields}
+            for field, amount in failed.increments.items():
+                entry.increments[field] = entry.increments.get(field, 0) + amount
+            entry.entries = failed.entries + entry.entries
+            entry.maxlen = entry.maxlen or failed.maxlen
+        if dropped:
+            STATUS_DROPPED.labels("overflow").inc(dropped)
+            logger.error(f" Dropped {dropped} status key(s): {self._max_pending} already waiting for Redis")
+
+    async def flush(self):
+        """Flush everything buffered now and wait for all in-flight flushes, including earlier ones."""
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def close(self):
+        """Flush everything buffered and wait for in-flight flushes; whatever still failed is dropped."""
+        await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            STATUS_DROPPED.labels("shutdown").inc(len(self._pending))
+            logger.error(f" Dropped {len(self._pending)} status key(s) at shutdown: {', '.join(list(self._pending)[:10])}")
+            self._pending = {}
+
+
+_status_writer: StatusWriter | None = None
+
+
+def get_status_writer(redis: Redis) -> StatusWriter:
+    """Return the process-wide status writer bound to `redis`."""
+    global _status_writer
+    if _status_writer is None:
+        _status_writer = StatusWriter(redis)
+    return _status_writer
+
+
+async def close_status_writer():
+    global _status_writer
+    if _status_writer is not None:
+        await _status_writer.close()
+        _status_writer = None
+
+
+def record_device_outcome(redis: Redis, notification_id: str, endpoint: str, outcome: str, error: str | None = None):
+    """
+    Count one device outcome (success | failed | invalid | retry) in the status hash
+    and append it to the notification's capped outcome stream.
+    """
+    writer = get_status_writer(redis)
+    writer.hincrby(status_key(notification_id), f"{outcome}_count", 1, NOTIFICATION_STATUS_TTL)
+    fields = {"endpoint": endpoint or "", "outcome": outcome}
+    if error:
+        fields["error"] = error[:RESULT_ERROR_MAX_CHARS]
+    writer.xadd(outcomes_key(notification_id), fields, RESULT_STREAM_MAXLEN, NOTIFICATION_STATUS_TTL)
+
+
+# Set member recording that at least one device received the notification (never a hex digest)
+SENT_MARKER = "sent"
+
+
+async def write_delivery_checkpoint(redis: Redis, notification_id: str, endpoints: list[str], sent: bool):
+    """
+    Checkpoint devices as done for this notification (delivered, or permanently
+    undeliverable), plus the sent marker, in one round trip. Written directly
+    rather than through the StatusWriter: it must be in Redis before the
+    message is acked or republished, or a redelivery would send again.
+    """
+    members = [endpoint_digest(endpoint) for endpoint in endpoints]
+    if sent:
+        members.append(SENT_MARKER)
+    if not members:
+        return
+    key = delivered_key(notification_id)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.sadd(key, *members)
+        pipe.expire(key, DELIVERY_CHECKPOINT_TTL)
+        await pipe.execute()
+
+
+class DeliveryCheckpoint:
+    """
+    Checkpoints one message's finished devices in chunks while its fan-out
+    runs. A chunk is written when it reaches `batch_size` devices or when
+    `flush_ms` has passed since the last write; a failed chunk stays pending
+    for the next one. The final flush() must complete before the message is
+    acked or republished.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        notification_id: str,
+        batch_size: int = DELIVERY_CHECKPOINT_BATCH_SIZE,
+        flush_ms: int = DELIVERY_CHECKPOINT_FLUSH_MS,
+    ):
+        self._redis = redis
+        self._notification_id = notification_id
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_ms / 1000
+        self._endpoints: list[str] = []
+        self._sent = False
+        self._last_write = time.monotonic()
+
+    async def add(self, endpoint: str, success: bool):
+        """Record a device as done (delivered, or permanently undeliverable)."""
+        self._endpoints.append(endpoint)
+        self._sent = self._sent or success
+        if len(self._endpoints) >= self._batch_size or time.monotonic() - self._last_write >= self._flush_interval:
+            try:
+                await self.flush()
+            except Exception as e:
+                # Still pending: the next chunk or the final flush writes it
+                logger.warning(f" Could not write delivery checkpoint chunk for {self._notification_id}: {e}")
+
+    async def flush(self):
+        """Write every pending device (and the sent marker) in one round trip."""
+        endpoints, sent = self._endpoints, self._sent
+        self._endpoints, self._sent = [], False
+        self._last_write = time.monotonic()
+        try:
+            await write_delivery_checkpoint(self._redis, self._notification_id, endpoints, sent)
+        except Exception:
+            self._endpoints = endpoints + self._endpoints
+            self._sent = self._sent or sent
+            raise
+
+
+async def read_delivery_checkpoint(redis: Redis, notification_id: str, endpoints: list[str]) -> tuple[list[bool], bool]:
+    """
+    Which of `endpoints` are already done for this notification, and whether any
+    device has received it, in one SMISMEMBER.
+    """
+    members = [endpoint_digest(endpoint) for endpoint in endpoints] + [SENT_MARKER]
+    flags = await redis.smismember(delivered_key(notification_id), members)
+    return [bool(flag) for flag in flags[:-1]], bool(flags[-1])
+
+
+async def read_notification_status(redis: Redis, notification_id: str, recent: int = 20) -> dict | None:
+    """
+    Read a notification's status hash and its most recent device outcomes.
+    Cost is independent of how many devices the notification fanned out to.
+    """
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hgetall(status_key(notification_id))
+        pipe.xrevrange(outcomes_key(notification_id), count=recent)
+        status, outcomes = await pipe.execute()
+    if not status:
+        return None
+    return {**status, "recent_outcomes": [fields for _, fields in outcomes]}
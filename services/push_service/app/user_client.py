@@ -1,4 +1,5 @@
 import os
+import asyncio
 import httpx
 from loguru import logger
 from dotenv import load_dotenv
@@ -13,35 +14,135 @@ USER_SERVICE_URL = os.getenv("USER_SERVICE_URL")
 if not USER_SERVICE_URL:
     raise ValueError(" USER_SERVICE_URL is not set in .env")
 
+# Invalid tokens are coalesced and flushed every N tokens or every T ms
+INVALID_TOKEN_BATCH_SIZE = int(os.getenv("INVALID_TOKEN_BATCH_SIZE", "500"))
+INVALID_TOKEN_FLUSH_MS = int(os.getenv("INVALID_TOKEN_FLUSH_MS", "1000"))
+# Longest the blocking consumer holds a message's ack for its token deactivation; slower requests
+# (and their retries) carry on in the background instead of stalling the pika thread
+INVALID_TOKEN_DRAIN_MS = int(os.getenv("INVALID_TOKEN_DRAIN_MS", "500"))
 
-# Mark token invalid with retries + structured logs
+# Shared HTTP client, created on the consumer's event loop
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=10.0)
+    return _http_client
+
+
+# Bulk-deactivate tokens with retries + structured logs
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, max=10))
-async def mark_token_invalid(user_id: str, token: str):
+async def deactivate_tokens(tokens: list[str]):
     """
-    Notify the User Service that a web push subscription (token) is invalid.
+    Notify the User Service that a batch of web push subscriptions (tokens)
+    is invalid, in a single request.
     Retries up to 3 times with exponential backoff on transient errors.
     """
-    url = f"{USER_SERVICE_URL}/api/users/{user_id}/devices/{token}/deactivate"
+    url = f"{USER_SERVICE_URL}/api/v1/users/devices/deactivate"
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            response = await client.put(url)
-            response.raise_for_status()
-            logger.info(f" Token invalidated | user_id={user_id}, token={token[:20]}...")
-
-        except httpx.HTTPStatusError as e:
-            status = e.response.status_code
-            if 400 <= status < 500:
-                # Permanent client error
-                logger.warning(f" Client error ({status}) when deactivating token for user {user_id}")
-            else:
-                # Server-side issue (retryable)
-                logger.error(f" Server error ({status}) for user {user_id} while deactivating token")
-                raise
-        except httpx.RequestError as e:
-            # Network issues, timeouts, DNS failures — retryable
-            logger.error(f" Network error while calling User Service: {e}")
+    try:
+        response = await get_http_client().post(url, json={"tokens": tokens})
+        response.raise_for_status()
+        logger.info(f" Tokens invalidated | requested={len(tokens)}, deactivated={response.json()['data']['deactivated']}")
+
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        if 400 <= status < 500:
+            # Permanent client error
+            logger.warning(f" Client error ({status}) when deactivating {len(tokens)} token(s)")
+        else:
+            # Server-side issue (retryable)
+            logger.error(f" Server error ({status}) while deactivating {len(tokens)} token(s)")
             raise
+    except httpx.RequestError as e:
+        # Network issues, timeouts, DNS failures — retryable
+        logger.error(f" Network error while calling User Service: {e}")
+        raise
+    except Exception as e:
+        logger.exception(f" Unexpected error deactivating {len(tokens)} token(s): {e}")
+        raise
+
+
+class TokenInvalidationBuffer:
+    """
+    Coalesces invalid tokens from many in-flight messages into bulk
+    deactivation requests, flushed on size or interval.
+    """
+
+    def __init__(self, batch_size: int = INVALID_TOKEN_BATCH_SIZE, flush_ms: int = INVALID_TOKEN_FLUSH_MS):
+        self._batch_size = max(1, batch_size)
+        self._flush_interval = flush_ms / 1000
+        self._tokens: set[str] = set()
+        self._timer: asyncio.TimerHandle | None = None
+        self._flushes: set[asyncio.Task] = set()
+
+    def add(self, token: str):
+        self._tokens.add(token)
+        if len(self._tokens) >= self._batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self._flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._tokens:
+            return
+        tokens, self._tokens = list(self._tokens), set()
+        task = asyncio.get_running_loop().create_task(self._flush(tokens))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    @staticmethod
+    async def _flush(tokens: list[str]):
+        try:
+            await deactivate_tokens(tokens)
         except Exception as e:
-            logger.exception(f" Unexpected error marking token invalid for user {user_id}: {e}")
-            raise
+            logger.error(f" Dropping {len(tokens)} invalid token(s) after retries: {e}")
+
+    async def flush(self, timeout: float | None = None):
+        """
+        Send whatever is buffered now and wait for all in-flight flushes,
+        retries included, or at most `timeout` seconds. Flushes still running
+        then are not cancelled: they continue whenever the loop next runs.
+        """
+        self._start_flush()
+        if self._flushes:
+            await asyncio.wait(self._flushes, timeout=timeout)
+
+    async def close(self):
+        """Flush whatever is buffered and wait for in-flight flushes."""
+        await self.flush()
+
+
+_invalidation_buffer: TokenInvalidationBuffer | None = None
+
+
+def get_invalidation_buffer() -> TokenInvalidationBuffer:
+    global _invalidation_buffer
+    if _invalidation_buffer is None:
+        _invalidation_buffer = TokenInvalidationBuffer()
+    return _invalidation_buffer
+
+
+async def mark_token_invalid(user_id: str, token: str):
+    """
+    Queue a web push subscription (token) for deactivation in the User Service.
+    Tokens are sent in bulk by the shared TokenInvalidationBuffer.
+    """
+    logger.info(f" Token queued for invalidation | user_id={user_id}, token={token[:20]}...")
+    get_invalidation_buffer().add(token)
+
+
+async def close_user_client():
+    """Flush pending invalidations and close the shared HTTP client."""
+    global _http_client, _invalidation_buffer
+    if _invalidation_buffer is not None:
+        await _invalidation_buffer.close()
+        _invalidation_buffer = None
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
@@ -0,0 +1,56 @@
+import os
+import time
+import threading
+from urllib.parse import urlparse
+from py_vapid import Vapid
+from loguru import logger
+
+# Lifetime of a signed VAPID JWT (spec maximum is 24h) and how early to re-sign it
+VAPID_TOKEN_TTL = int(os.getenv("VAPID_TOKEN_TTL", str(12 * 60 * 60)))
+VAPID_REFRESH_MARGIN = int(os.getenv("VAPID_REFRESH_MARGIN", "300"))
+
+
+def load_vapid_key(private_key: str) -> Vapid:
+    """Parse the VAPID private key once (PEM/DER file path or raw base64url string)."""
+    if os.path.isfile(private_key):
+        return Vapid.from_file(private_key_file=private_key)
+    return Vapid.from_string(private_key=private_key)
+
+
+def push_audience(endpoint: str) -> str:
+    """VAPID `aud` claim for an endpoint: the push service origin."""
+    url = urlparse(endpoint)
+    return f"{url.scheme}://{url.netloc}"
+
+
+class VapidHeaderCache:
+    """
+    Caches signed VAPID headers per push-service audience.
+    A JWT is re-signed only when the cached one is within
+    VAPID_REFRESH_MARGIN seconds of its `exp`.
+    """
+
+    def __init__(self, vapid: Vapid, subject: str, ttl: int = VAPID_TOKEN_TTL, margin: int = VAPID_REFRESH_MARGIN):
+        self._vapid = vapid
+        self._subject = subject
+        self._ttl = ttl
+        self._margin = min(margin, ttl // 2)
+        self._cache: dict[str, tuple[int, dict]] = {}
+        self._lock = threading.Lock()
+
+    def headers_for(self, endpoint: str) -> dict:
+        """Return the Authorization (and Crypto-Key) headers for `endpoint`."""
+        audience = push_audience(endpoint)
+        entry = self._cache.get(audience)
+        if entry and entry[0] - self._margin > time.time():
+            return dict(entry[1])
+
+        with self._lock:
+            entry = self._cache.get(audience)
+            if not entry or entry[0] - self._margin <= time.time():
+                exp = int(time.time()) + self._ttl
+                headers = self._vapid.sign({"sub": self._subject, "aud": audience, "exp": exp})
+                entry = (exp, headers)
+                self._cache[audience] = entry
+                logger.debug(f" Signed VAPID token for {audience} (exp={exp})")
+        return dict(entry[1])
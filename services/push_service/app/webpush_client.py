@@ -1,10 +1,15 @@
 import os
 import json
+import time
 import asyncio
 from pywebpush import webpush, WebPushException
 from loguru import logger
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
+
+from app.vapid import load_vapid_key, push_audience, VapidHeaderCache
+from app.webpush_transport import WebPushTransport
+from app.origin_limits import OriginGuards
+from app.metrics import SEND_SECONDS
 
 # Load environment variables
 
@@ -17,11 +22,44 @@ VAPID_EMAIL = os.getenv("VAPID_EMAIL")
 if not all([VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY, VAPID_EMAIL]):
     raise ValueError(" Missing VAPID configuration in .env (need VAPID_PRIVATE_KEY, VAPID_PUBLIC_KEY, VAPID_EMAIL)")
 
+# Parse the private key once; signed JWTs are cached per push-service origin
+VAPID_KEY = load_vapid_key(VAPID_PRIVATE_KEY)
+vapid_headers = VapidHeaderCache(VAPID_KEY, f"mailto:{VAPID_EMAIL}")
+
+# Rate limiter + circuit breaker per push-service origin
+origin_guards = OriginGuards()
+
+# Send path: "pywebpush" (requests in the default executor) or "httpx" (async pooled transport)
+WEBPUSH_TRANSPORT = os.getenv("WEBPUSH_TRANSPORT", "pywebpush").lower()
+
+# Async transport singleton, created on the consumer's event loop
+_transport: WebPushTransport | None = None
+
+
+def get_webpush_transport() -> WebPushTransport:
+    global _transport
+    if _transport is None:
+        _transport = WebPushTransport()
+    return _transport
+
+
+async def close_webpush_transport():
+    """Close pooled push-service connections on shutdown."""
+    global _transport
+    if _transport is not None:
+        await _transport.aclose()
+        _transport = None
+
+
 # Web Push send logic (async)
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, max=10))
 async def send_webpush_message(subscription: dict, title: str, body: str, data: dict = None):
     """
     Sends a Web Push notification using VAPID keys.
+    The VAPID Authorization header comes from the per-origin cache; the
+    payload is encrypted and sent by the transport chosen with WEBPUSH_TRANSPORT.
+    A single attempt: retries go through the broker's delay queues.
+    Sends are paced per origin; raises OriginUnavailable without sending
+    while the origin is paused (429/503 Retry-After) or its breaker is open.
 
     subscription: dict like {
         "endpoint": "https://fcm.googleapis.com/fcm/send/...",
@@ -35,19 +73,35 @@ async def send_webpush_message(subscription: dict, title: str, body: str, data:
         "data": data or {}
     })
 
-    try:
-        response = await loop.run_in_executor(
-            None,
-            lambda: webpush(
-                subscription_info=subscription,
-                data=payload,
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims={"sub": f"mailto:{VAPID_EMAIL}"}
-            )
-        )
-        logger.info(f" Web push sent to {subscription.get('endpoint')[:30]}... ({response.status_code})")
-        return response.status_code
-
-    except WebPushException as e:
-        logger.error(f" Web push failed for {subscription.get('endpoint')[:30]}...: {e}")
-        raise
+    headers = vapid_headers.headers_for(subscription["endpoint"])
+    origin = push_audience(subscription["endpoint"])
+    guard = origin_guards.get(origin)
+
+    async with guard.sending():
+        started = time.perf_counter()
+        status = "error"
+        try:
+            if WEBPUSH_TRANSPORT == "httpx":
+                response = await get_webpush_transport().send(subscription, payload.encode("utf8"), headers)
+            else:
+                response = await loop.run_in_executor(
+                    None,
+                    lambda: webpush(
+                        subscription_info=subscription,
+                        data=payload,
+                        headers=headers
+                    )
+                )
+            status = response.status_code
+            logger.info(f" Web push sent to {subscription.get('endpoint')[:30]}... ({response.status_code})")
+            return response.status_code
+
+        except WebPushException as e:
+            if e.response is not None:
+                status = e.response.status_code
+                guard.observe_response(e.response)
+            logger.error(f" Web push failed for {subscription.get('endpoint')[:30]}...: {e}")
+            raise
+
+        finally:
+            SEND_SECONDS.labels(origin, str(status)).observe(time.perf_counter() - started)
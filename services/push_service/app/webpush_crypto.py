@@ -0,0 +1,143 @@
+import os
+import base64
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import http_ece
+from cryptography.hazmat.primitives.asymmetric import ec
+from loguru import logger
+
+# Encryption offload: 0 encrypts inline on the event loop, N uses N worker processes
+ENCRYPTION_WORKERS = int(os.getenv("ENCRYPTION_WORKERS", "0"))
+ENCRYPTION_BATCH_SIZE = int(os.getenv("ENCRYPTION_BATCH_SIZE", "64"))
+ENCRYPTION_BATCH_WINDOW_MS = float(os.getenv("ENCRYPTION_BATCH_WINDOW_MS", "2"))
+
+
+def _b64url_decode(value: str | bytes) -> bytes:
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return base64.urlsafe_b64decode(value + b"=" * (-len(value) % 4))
+
+
+def encrypt_payload(keys: dict, payload: bytes) -> bytes:
+    """
+    Encrypt `payload` for one subscription using RFC 8291 (aes128gcm).
+
+    keys: the subscription's {"p256dh": ..., "auth": ...} (base64url strings)
+    Returns the request body to POST to the push service.
+    """
+    if not keys or not keys.get("p256dh") or not keys.get("auth"):
+        raise ValueError("Subscription is missing p256dh/auth keys")
+
+    receiver_key = _b64url_decode(keys["p256dh"])
+    if len(receiver_key) != 65 or receiver_key[0] != 0x04:
+        raise ValueError("Invalid p256dh key specified")
+
+    # Ephemeral ECDH key, used for this message only
+    server_key = ec.generate_private_key(ec.SECP256R1())
+    return http_ece.encrypt(
+        payload,
+        private_key=server_key,
+        dh=receiver_key,
+        auth_secret=_b64url_decode(keys["auth"]),
+        version="aes128gcm",
+    )
+
+
+def encrypt_batch(items: list[tuple[dict, bytes]]) -> list[tuple[bytes | None, str | None]]:
+    """
+    Encrypt many (keys, payload) pairs; runs inside pool worker processes.
+    Returns (body, None) or (None, error) per item so one bad key does not fail the batch.
+    """
+    results = []
+    for keys, payload in items:
+        try:
+            results.append((encrypt_payload(keys, payload), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+class PayloadEncryptor:
+    """
+    Runs payload encryption on a ProcessPoolExecutor so ECDH/HKDF/AES-GCM
+    work does not hold the GIL on the consumer's event loop.
+    Concurrent `encrypt` calls are collected for up to ENCRYPTION_BATCH_WINDOW_MS
+    (or ENCRYPTION_BATCH_SIZE items) and shipped to a worker as one batch.
+    """
+
+    def __init__(
+        self,
+        workers: int = ENCRYPTION_WORKERS,
+        batch_size: int = ENCRYPTION_BATCH_SIZE,
+        batch_window_ms: float = ENCRYPTION_BATCH_WINDOW_MS,
+    ):
+        self._pool = None
+        if workers > 0:
+            self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f" Payload encryption offloaded to {workers} worker process(es)")
+        self._batch_size = max(1, batch_size)
+        self._batch_window = batch_window_ms / 1000
+        self._pending: list[tuple[dict, bytes, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def encrypt(self, keys: dict, payload: bytes) -> bytes:
+        """Encrypt one payload, batched with other concurrent callers."""
+        if self._pool is None:
+            return encrypt_payload(keys, payload)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((keys, payload, future))
+        if len(self._pending) >= self._batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._batch_window, self._flush)
+        return await future
+
+    async def encrypt_many(self, items: list[tuple[dict, bytes]]) -> list[bytes]:
+        """Encrypt a batch of (keys, payload) pairs in one pool round trip."""
+        if self._pool is None:
+            results = encrypt_batch(items)
+        else:
+            results = await asyncio.get_running_loop().run_in_executor(self._pool, encrypt_batch, items)
+        for _, error in results:
+            if error:
+                raise ValueError(error)
+        return [body for body, _ in results]
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        loop = asyncio.get_running_loop()
+        done = loop.run_in_executor(self._pool, encrypt_batch, [(keys, payload) for keys, payload, _ in batch])
+        done.add_done_callback(lambda result: self._resolve(batch, result))
+
+    @staticmethod
+    def _resolve(batch, result: asyncio.Future):
+        error = None if result.cancelled() else result.exception()
+        for index, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            if result.cancelled():
+                future.cancel()
+                continue
+            if error:
+                future.set_exception(error)
+                continue
+            body, item_error = result.result()[index]
+            if item_error:
+                future.set_exception(ValueError(item_error))
+            else:
+                future.set_result(body)
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
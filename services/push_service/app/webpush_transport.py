@@ -0,0 +1,85 @@
+import os
+import httpx
+from pywebpush import WebPushException
+from loguru import logger
+
+from app.vapid import push_audience
+from app.webpush_crypto import PayloadEncryptor
+
+# Connection pool settings (per push-service origin)
+WEBPUSH_HTTP2 = os.getenv("WEBPUSH_HTTP2", "true").lower() == "true"
+WEBPUSH_MAX_CONNECTIONS = int(os.getenv("WEBPUSH_MAX_CONNECTIONS", "100"))
+WEBPUSH_MAX_KEEPALIVE = int(os.getenv("WEBPUSH_MAX_KEEPALIVE", "20"))
+WEBPUSH_KEEPALIVE_EXPIRY = float(os.getenv("WEBPUSH_KEEPALIVE_EXPIRY", "60"))
+WEBPUSH_TIMEOUT = float(os.getenv("WEBPUSH_TIMEOUT", "10"))
+WEBPUSH_TTL = int(os.getenv("WEBPUSH_TTL", "0"))
+
+
+class WebPushTransport:
+    """
+    Async web push sender with one long-lived, pooled (HTTP/2 when the push
+    service supports it) client per push-service origin.
+    Payloads are encrypted (aes128gcm) inline or on the encryptor's process
+    pool; the network stage always stays on the event loop.
+    """
+
+    def __init__(
+        self,
+        encryptor: PayloadEncryptor | None = None,
+        http2: bool = WEBPUSH_HTTP2,
+        max_connections: int = WEBPUSH_MAX_CONNECTIONS,
+        max_keepalive: int = WEBPUSH_MAX_KEEPALIVE,
+        keepalive_expiry: float = WEBPUSH_KEEPALIVE_EXPIRY,
+        timeout: float = WEBPUSH_TIMEOUT,
+    ):
+        self._encryptor = encryptor or PayloadEncryptor()
+        self._http2 = http2
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._timeout = httpx.Timeout(timeout)
+        self._clients: dict[str, httpx.AsyncClient] = {}
+
+    def _client_for(self, origin: str) -> httpx.AsyncClient:
+        client = self._clients.get(origin)
+        if client is None:
+            client = httpx.AsyncClient(http2=self._http2, limits=self._limits, timeout=self._timeout)
+            self._clients[origin] = client
+            logger.info(f" Opened web push connection pool for {origin} (http2={self._http2})")
+        return client
+
+    async def send(self, subscription: dict, payload: bytes, headers: dict, ttl: int = WEBPUSH_TTL) -> httpx.Response:
+        """
+        Encrypt `payload` for `subscription` and POST it to its endpoint.
+        `headers` carries the VAPID Authorization (and Crypto-Key) headers.
+        Raises WebPushException for any non-2xx response, like pywebpush.
+        """
+        endpoint = subscription["endpoint"]
+        body = await self._encryptor.encrypt(subscription.get("keys"), payload)
+        return await self.send_encrypted(endpoint, body, headers, ttl)
+
+    async def send_encrypted(self, endpoint: str, body: bytes, headers: dict, ttl: int = WEBPUSH_TTL) -> httpx.Response:
+        """POST an already-encrypted aes128gcm body to `endpoint`."""
+        request_headers = {
+            **headers,
+            "Content-Encoding": "aes128gcm",
+            "Content-Type": "application/octet-stream",
+            "TTL": str(ttl),
+        }
+        client = self._client_for(push_audience(endpoint))
+        response = await client.post(endpoint, content=body, headers=request_headers)
+        if response.status_code > 202:
+            raise WebPushException(
+                f"Push failed: {response.status_code} {response.reason_phrase}\nResponse body:{response.text}",
+                response=response,
+            )
+        return response
+
+    async def aclose(self):
+        """Close every pooled client and the encryption workers."""
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+        self._encryptor.shutdown()
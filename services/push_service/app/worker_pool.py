@@ -0,0 +1,129 @@
+import os
+import signal
+import asyncio
+import threading
+import multiprocessing
+from loguru import logger
+
+from app.metrics import mark_process_dead
+
+# Supervisor configuration
+CONSUMER_PROCESSES = int(os.getenv("CONSUMER_PROCESSES", "1"))
+CONSUMER_START_METHOD = os.getenv("CONSUMER_START_METHOD", "spawn")
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "2"))
+
+
+def _worker_main(index: int, mode: str):
+    """
+    Entry point of a consumer worker process.
+    Each worker owns its own AMQP connection and Redis client and drains
+    in-flight messages when it receives SIGTERM.
+    """
+    # Never reuse a Redis client inherited from the parent process
+    import app.redis_client as redis_module
+    redis_module.redis_client = None
+
+    logger.info(f" Consumer worker #{index} started (pid={os.getpid()}, mode={mode})")
+
+    if mode == "asyncio":
+        from app.async_consumer import run_async_consumer
+
+        async def run():
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, stop_event.set)
+            await run_async_consumer(stop_event)
+
+        asyncio.run(run())
+    else:
+        from app.consumer import start_consumer
+
+        stop_event = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop_event.set())
+        start_consumer(stop_event)
+
+    logger.info(f" Consumer worker #{index} drained and exited (pid={os.getpid()})")
+
+
+class ConsumerSupervisor:
+    """
+    Runs N consumer worker processes, restarts any that die and
+    drains them all on shutdown.
+    """
+
+    def __init__(self, workers: int = CONSUMER_PROCESSES, mode: str = "blocking"):
+        self.workers = max(1, workers)
+        self.mode = mode
+        self._ctx = multiprocessing.get_context(CONSUMER_START_METHOD)
+        self._processes: list[multiprocessing.Process | None] = [None] * self.workers
+        self._stopping = threading.Event()
+        self._monitor: threading.Thread | None = None
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self.mode),
+            name=f"push-consumer-{index}",
+            daemon=False,
+        )
+        process.start()
+        self._processes[index] = process
+        logger.info(f" Spawned consumer worker #{index} (pid={process.pid})")
+
+    def _watch(self):
+        while not self._stopping.wait(1):
+            for index, process in enumerate(self._processes):
+                if process is None or process.is_alive() or self._stopping.is_set():
+                    continue
+                logger.warning(
+                    f" Consumer worker #{index} (pid={process.pid}) exited with code {process.exitcode}, "
+                    f"restarting in {WORKER_RESTART_DELAY} seconds..."
+                )
+                mark_process_dead(process.pid)
+                process.close()
+                self._processes[index] = None
+                if self._stopping.wait(WORKER_RESTART_DELAY):
+                    return
+                self._spawn(index)
+
+    def start(self):
+        """Start all workers and the background restart monitor."""
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor = threading.Thread(target=self._watch, name="push-consumer-supervisor", daemon=True)
+        self._monitor.start()
+        logger.info(f" Consumer supervisor started with {self.workers} worker(s) (mode={self.mode})")
+
+    def stop(self, timeout: float = WORKER_DRAIN_TIMEOUT):
+        """Ask every worker to drain (SIGTERM), then kill any that overrun `timeout`."""
+        self._stopping.set()
+        if self._monitor:
+            self._monitor.join()
+
+        alive = [p for p in self._processes if p is not None and p.is_alive()]
+        for process in alive:
+            process.terminate()
+
+        for process in alive:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f" Consumer worker pid={process.pid} did not drain in {timeout}s, killing it.")
+                process.kill()
+                process.join()
+            mark_process_dead(process.pid)
+        logger.info(" Consumer supervisor stopped, all workers exited.")
+
+
+if __name__ == "__main__":
+    # Standalone supervisor for consumer-only containers
+    supervisor = ConsumerSupervisor(mode=os.getenv("CONSUMER_MODE", "blocking").lower())
+    shutdown = threading.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: shutdown.set())
+    supervisor.start()
+    while not shutdown.wait(1):
+        pass
+    supervisor.stop()
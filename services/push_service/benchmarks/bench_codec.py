@@ -0,0 +1,116 @@
+"""
+Micro-benchmark: queue message decode+validate and encode cost per codec.
+
+    python -m benchmarks.bench_codec --devices 1,10,100,1000 --output codec.json
+
+Run from services/push_service. Needs no network or broker. For each
+device count it times decoding a body into a validated PushMessage and
+encoding it back (what a retry does), and reports microseconds per
+message and body size. `json` is the stdlib baseline the consumer used
+before the codec layer (decode only, no validation).
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+
+import app.codec as codec
+from app.codec import JSON, MSGPACK, PushMessage, decode_message, encode_message
+
+
+def make_message(devices: int) -> dict:
+    return {
+        "notification_id": "bench-notification",
+        "user_id": "bench-user",
+        "devices": [
+            {
+                "endpoint": f"https://fcm.googleapis.com/fcm/send/{base64.urlsafe_b64encode(os.urandom(96)).decode()}",
+                "keys": {
+                    "p256dh": base64.urlsafe_b64encode(os.urandom(65)).rstrip(b"=").decode(),
+                    "auth": base64.urlsafe_b64encode(os.urandom(16)).rstrip(b"=").decode(),
+                },
+            }
+            for _ in range(devices)
+        ],
+        "title": "Benchmark",
+        "body": "Codec run",
+        "action_url": "https://example.com",
+        "publishedAt": "2030-01-01T09:00:00+00:00",
+    }
+
+
+def _time_per_call(fn, iterations: int) -> float:
+    """Best of three runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6
+
+
+def bench_stdlib_json(data: dict, iterations: int) -> dict:
+    body = json.dumps(data).encode("utf8")
+    return {
+        "decode_us": _time_per_call(lambda: json.loads(body), iterations),
+        "encode_us": _time_per_call(lambda: json.dumps(data).encode("utf8"), iterations),
+        "bytes": len(body),
+    }
+
+
+def bench_codec(data: dict, content_type: str, compress: bool, iterations: int) -> dict:
+    # encode_message reads the threshold on every call: 1 compresses everything, 0 nothing
+    codec.MESSAGE_ZSTD_MIN_BYTES = 1 if compress else 0
+    message = PushMessage.from_dict(data)
+    body, content_type, content_encoding = encode_message(message, content_type)
+    return {
+        "decode_us": _time_per_call(lambda: decode_message(body, content_type, content_encoding), iterations),
+        "encode_us": _time_per_call(lambda: encode_message(message, content_type), iterations),
+        "bytes": len(body),
+    }
+
+
+CODECS = {
+    "json": None,
+    "orjson": (JSON, False),
+    "msgpack": (MSGPACK, False),
+    "orjson+zstd": (JSON, True),
+    "msgpack+zstd": (MSGPACK, True),
+}
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=_int_list, default=[1, 10, 100, 1000], help="comma separated device counts")
+    parser.add_argument("--iterations", type=int, default=0, help="calls per timing (default: scaled to message size)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'devices':>8}  {'codec':<14}{'decode µs':>11}{'encode µs':>11}{'total µs':>10}{'bytes':>10}")
+    for devices in args.devices:
+        data = make_message(devices)
+        iterations = args.iterations or max(20, 20000 // devices)
+        for name, spec in CODECS.items():
+            run = bench_stdlib_json(data, iterations) if spec is None else bench_codec(data, *spec, iterations)
+            run.update(devices=devices, codec=name, iterations=iterations)
+            results.append(run)
+            print(
+                f"{devices:>8}  {name:<14}{run['decode_us']:>11.1f}{run['encode_us']:>11.1f}"
+                f"{run['decode_us'] + run['encode_us']:>10.1f}{run['bytes']:>10}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": {"python": sys.version.split()[0]}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Micro-benchmark: web push payload encryptions/sec, inline vs process pool.
+
+    python -m benchmarks.bench_encryption --count 5000 --workers 4
+
+Run from services/push_service. Needs no network or VAPID configuration.
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+import argparse
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from app.webpush_crypto import encrypt_payload, PayloadEncryptor
+
+
+def make_subscription_keys(count: int) -> list[dict]:
+    """Generate realistic p256dh/auth pairs like a browser would."""
+    keys = []
+    for _ in range(count):
+        public = ec.generate_private_key(ec.SECP256R1()).public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )
+        keys.append({
+            "p256dh": base64.urlsafe_b64encode(public).rstrip(b"=").decode(),
+            "auth": base64.urlsafe_b64encode(os.urandom(16)).rstrip(b"=").decode(),
+        })
+    return keys
+
+
+def bench_inline(items: list[tuple[dict, bytes]]) -> float:
+    started = time.perf_counter()
+    for keys, payload in items:
+        encrypt_payload(keys, payload)
+    return time.perf_counter() - started
+
+
+async def bench_pool(items: list[tuple[dict, bytes]], workers: int, batch_size: int) -> float:
+    encryptor = PayloadEncryptor(workers=workers, batch_size=batch_size)
+    try:
+        # Warm up the worker processes so start-up cost is not measured
+        await asyncio.gather(*(encryptor.encrypt(keys, payload) for keys, payload in items[: workers * 4]))
+        started = time.perf_counter()
+        await asyncio.gather(*(encryptor.encrypt(keys, payload) for keys, payload in items))
+        return time.perf_counter() - started
+    finally:
+        encryptor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=2000, help="encryptions per run")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="pool worker processes")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--payload-bytes", type=int, default=256)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    payload = json.dumps({"title": "Benchmark", "body": "x" * args.payload_bytes, "data": {}}).encode()
+    distinct_keys = make_subscription_keys(min(args.count, 256))
+    items = [(distinct_keys[i % len(distinct_keys)], payload) for i in range(args.count)]
+
+    inline_seconds = bench_inline(items)
+    pool_seconds = asyncio.run(bench_pool(items, args.workers, args.batch_size))
+
+    inline_rate = args.count / inline_seconds
+    pool_rate = args.count / pool_seconds
+    results = {
+        "count": args.count,
+        "payload_bytes": len(payload),
+        "inline": {"seconds": inline_seconds, "per_sec": inline_rate, "per_sec_per_core": inline_rate},
+        "pool": {
+            "workers": args.workers,
+            "batch_size": args.batch_size,
+            "seconds": pool_seconds,
+            "per_sec": pool_rate,
+            "per_sec_per_core": pool_rate / args.workers,
+        },
+    }
+
+    print(f"{'path':<8}{'workers':>8}{'enc/s':>12}{'enc/s/core':>14}")
+    print(f"{'inline':<8}{1:>8}{inline_rate:>12.0f}{inline_rate:>14.0f}")
+    print(f"{'pool':<8}{args.workers:>8}{pool_rate:>12.0f}{pool_rate / args.workers:>14.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
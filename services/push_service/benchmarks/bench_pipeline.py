@@ -0,0 +1,584 @@
+"""
+Offline throughput benchmark of the push pipeline (consume -> send -> status -> ack).
+
+    python -m benchmarks.bench_pipeline --devices 1,10,100 --concurrency 1,10,50 --output pipeline.json
+
+Run from services/push_service. Needs no network, RabbitMQ or Redis:
+- a fake push service (and User Service deactivate endpoint) runs in a
+  child process with configurable latency and response status mix
+- an in-memory queue stands in for the broker; deliveries go through the
+  real consumer handlers (process, publish retries, then ack): the async
+  consumer's handle_message in asyncio mode, the pika callback's
+  handle_delivery in blocking mode (the default CONSUMER_MODE, one
+  message at a time on a loop that only runs per message).
+  Retry tier messages are requeued at once: the tier delay is spent in
+  the broker, not in the worker, so a run measures work only
+- fakeredis stands in for Redis unless --redis-url is given
+
+Blocking runs end with an idle check: after the queue drains the
+consumer sits idle for --idle-seconds, then a separate client reads what
+actually reached Redis (final status, delivery checkpoints) and the
+fake User Service reports how many invalid tokens were deactivated.
+Anything still buffered at that point is reported as a mismatch.
+
+Requires `fakeredis` (pip install fakeredis) when --redis-url is not set.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import statistics
+import collections
+import multiprocessing
+import urllib.request
+
+OUTCOMES = ("success", "failed", "invalid", "retry", "skipped")
+# Device outcomes that close a device for good (retry ends in one of these, or in failed when parked)
+FINAL_OUTCOMES = ("success", "failed", "invalid")
+MODES = ("asyncio", "blocking")
+
+
+# ---------- fake push service (child process) ----------
+
+def _parse_mix(spec: str) -> list[tuple[int, float]]:
+    """'201=0.9,410=0.05,429=0.03,500=0.02' -> [(201, 0.9), ...]"""
+    mix = []
+    for part in spec.split(","):
+        status, weight = part.split("=")
+        mix.append((int(status), float(weight)))
+    return mix
+
+
+async def _handle_connection(reader, writer, latency: float, mix, rng: random.Random, stats: dict):
+    statuses, weights = zip(*mix)
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.split(b"\r\n")
+            path = lines[0].split()[1].decode()
+            length = 0
+            for line in lines[1:]:
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            body = await reader.readexactly(length) if length else b""
+
+            if path.startswith("/api/v1/users/devices/deactivate"):
+                status = 200
+                tokens = len(json.loads(body)["tokens"])
+                stats["deactivated"] += tokens
+                payload = json.dumps({"data": {"deactivated": tokens}}).encode()
+            elif path == "/bench/stats":
+                status = 200
+                payload = json.dumps(stats).encode()
+            else:
+                if latency:
+                    await asyncio.sleep(latency)
+                status = rng.choices(statuses, weights)[0]
+                payload = b""
+
+            headers = f"HTTP/1.1 {status} X\r\nContent-Length: {len(payload)}\r\nContent-Type: application/json\r\n"
+            if status == 429:
+                headers += "Retry-After: 1\r\n"
+            writer.write(headers.encode() + b"\r\n" + payload)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _serve(port_pipe, latency_ms: float, mix_spec: str, seed: int):
+    async def run():
+        rng = random.Random(seed)
+        mix = _parse_mix(mix_spec)
+        stats = {"deactivated": 0}
+        server = await asyncio.start_server(
+            lambda r, w: _handle_connection(r, w, latency_ms / 1000, mix, rng, stats), "127.0.0.1", 0, backlog=1024
+        )
+        port_pipe.send(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+def start_fake_push_service(latency_ms: float, mix: str, seed: int):
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    process = ctx.Process(target=_serve, args=(child, latency_ms, mix, seed), daemon=True)
+    process.start()
+    return process, parent.recv()
+
+
+# ---------- broker stand-in ----------
+
+class FakeDelivery:
+    """Just enough of aio_pika's IncomingMessage for the consumer's handle_message."""
+
+    __slots__ = ("body", "content_type", "content_encoding", "enqueued_at", "delivered_at", "_broker")
+
+    def __init__(self, body: bytes, broker: "FakeBroker", content_type: str | None, content_encoding: str | None):
+        self.body = body
+        self.content_type = content_type
+        self.content_encoding = content_encoding
+        self.enqueued_at = time.perf_counter()
+        self.delivered_at = self.enqueued_at
+        self._broker = broker
+
+    async def ack(self):
+        self._broker.acked(self)
+
+    async def nack(self, requeue: bool = True):
+        self._broker.nacks += 1
+        if requeue:
+            self._broker.queue.put_nowait(self)
+
+
+class FakeBroker:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # Delivery-to-ack (processing) and publish-to-ack (including queue wait) per delivery
+        self.latencies: list[float] = []
+        self.end_to_end: list[float] = []
+        self.nacks = 0
+        self.retries = 0
+        self.parked = 0
+        self.done = asyncio.Event()
+        # Deliveries published but not yet acked
+        self.pending = 0
+
+    def publish(self, body: bytes, content_type: str | None = "application/json", content_encoding: str | None = None):
+        self.pending += 1
+        self.queue.put_nowait(FakeDelivery(body, self, content_type, content_encoding))
+
+    async def publish_to(self, publication):
+        """The consumer's retry publisher: tiers loop straight back, the parking queue is counted."""
+        from app.retry_queues import PARKING_QUEUE_NAME
+        if publication.routing_key == PARKING_QUEUE_NAME:
+            self.parked += 1
+        else:
+            self.retries += 1
+            self.publish(publication.body, publication.content_type, publication.content_encoding)
+
+    def acked(self, delivery: FakeDelivery):
+        now = time.perf_counter()
+        self.latencies.append(now - delivery.delivered_at)
+        self.end_to_end.append(now - delivery.enqueued_at)
+        self.pending -= 1
+        if self.pending <= 0:
+            self.done.set()
+
+
+class FakeChannel:
+    """Just enough of a confirm-mode pika BlockingChannel for the consumer's handle_delivery."""
+
+    def __init__(self):
+        # (delivery_tag, body, properties, enqueued_at) waiting to be delivered
+        self.queue: collections.deque = collections.deque()
+        self.unacked: dict[int, tuple[float, float]] = {}
+        self.latencies: list[float] = []
+        self.end_to_end: list[float] = []
+        self.nacks = 0
+        self.retries = 0
+        self.parked = 0
+        self._next_tag = 0
+
+    def publish(self, body: bytes, content_type: str | None = "application/json", content_encoding: str | None = None):
+        import pika
+        self._next_tag += 1
+        properties = pika.BasicProperties(content_type=content_type, content_encoding=content_encoding)
+        self.queue.append((self._next_tag, body, properties, time.perf_counter()))
+
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes, properties=None):
+        """Confirmed at once: tiers loop straight back, the parking queue is counted."""
+        from app.retry_queues import PARKING_QUEUE_NAME
+        if routing_key == PARKING_QUEUE_NAME:
+            self.parked += 1
+        else:
+            self.retries += 1
+            self.publish(body, properties.content_type, properties.content_encoding)
+
+    def basic_ack(self, delivery_tag: int):
+        now = time.perf_counter()
+        delivered_at, enqueued_at = self.unacked.pop(delivery_tag)
+        self.latencies.append(now - delivered_at)
+        self.end_to_end.append(now - enqueued_at)
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True):
+        self.nacks += 1
+        self.unacked.pop(delivery_tag)
+
+    def deliver(self):
+        from pika.spec import Basic
+        tag, body, properties, enqueued_at = self.queue.popleft()
+        self.unacked[tag] = (time.perf_counter(), enqueued_at)
+        return Basic.Deliver(delivery_tag=tag), properties, body
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _summary(values: list[float]) -> dict:
+    return {
+        "p50": _percentile(values, 50) * 1000,
+        "p95": _percentile(values, 95) * 1000,
+        "p99": _percentile(values, 99) * 1000,
+        "mean": statistics.fmean(values) * 1000 if values else 0.0,
+    }
+
+
+def _outcome_totals() -> dict:
+    from prometheus_client import REGISTRY
+    return {o: REGISTRY.get_sample_value("push_devices_total", {"outcome": o}) or 0.0 for o in OUTCOMES}
+
+
+def _make_messages(base_url: str, keys: list[dict], messages: int, devices: int) -> list[tuple[str, bytes]]:
+    """(notification_id, body) per message"""
+    # Fresh ids per case: delivery checkpoints would otherwise skip devices already sent
+    case_id = uuid.uuid4().hex[:8]
+    made = []
+    for m in range(messages):
+        subscriptions = [
+            {"endpoint": f"{base_url}/push/{m}-{d}", "keys": keys[(m * devices + d) % len(keys)]}
+            for d in range(devices)
+        ]
+        notification_id = f"bench-{case_id}-{m}"
+        made.append((notification_id, json.dumps({
+            "notification_id": notification_id,
+            "user_id": f"user-{m}",
+            "devices": subscriptions,
+            "title": "Benchmark",
+            "body": "Throughput run",
+            "action_url": "https://example.com",
+        }).encode()))
+    return made
+
+
+def _deactivated_tokens(base_url: str) -> int:
+    """Tokens the fake User Service has been asked to deactivate so far."""
+    with urllib.request.urlopen(f"{base_url}/bench/stats", timeout=5) as response:
+        return json.load(response)["deactivated"]
+
+
+async def run_case(redis, base_url: str, keys: list[dict], messages: int, devices: int, concurrency: int) -> dict:
+    from app.async_consumer import handle_message
+    from app.status_writer import get_status_writer
+
+    broker = FakeBroker()
+    for _, body in _make_messages(base_url, keys, messages, devices):
+        broker.publish(body)
+
+    # `concurrency` deliveries in flight, like prefetch with the asyncio consumer
+    async def consume():
+        while not broker.done.is_set():
+            try:
+                delivery = await asyncio.wait_for(broker.queue.get(), timeout=0.1)
+            except asyncio.TimeoutError:
+                continue
+            delivery.delivered_at = time.perf_counter()
+            await handle_message(redis, delivery, broker.publish_to)
+
+    before = _outcome_totals()
+    started = time.perf_counter()
+    workers = [asyncio.create_task(consume()) for _ in range(concurrency)]
+    await broker.done.wait()
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await get_status_writer(redis).close()
+    after = _outcome_totals()
+
+    return {
+        "mode": "asyncio",
+        "devices_per_message": devices,
+        "concurrency": concurrency,
+        "messages": messages,
+        "devices": messages * devices,
+        "seconds": elapsed,
+        "messages_per_sec": messages / elapsed,
+        "devices_per_sec": messages * devices / elapsed,
+        "latency_ms": _summary(broker.latencies),
+        "end_to_end_ms": _summary(broker.end_to_end),
+        "outcomes": {o: int(after[o] - before[o]) for o in OUTCOMES},
+        "retries": broker.retries,
+        "parked": broker.parked,
+        "nacks": broker.nacks,
+    }
+
+
+def _idle_check(redis, notification_ids: list[str], devices: int, invalid: int, deactivated: int) -> dict:
+    """
+    What a reader sees in Redis once the consumer is idle: every notification
+    has a final status, every device outcome is counted, and every sent
+    notification is checkpointed. `redis` is a sync client, so reading does
+    not run the consumer's event loop (and its pending flush timers).
+    """
+    from app.status_writer import SENT_MARKER, delivered_key, status_key
+
+    with redis.pipeline(transaction=False) as pipe:
+        for notification_id in notification_ids:
+            pipe.hgetall(status_key(notification_id))
+            pipe.sismember(delivered_key(notification_id), SENT_MARKER)
+        replies = pipe.execute()
+
+    not_final = uncounted = unchecked = 0
+    for status, checkpointed in zip(replies[::2], replies[1::2]):
+        if status.get("status") not in ("sent", "failed"):
+            not_final += 1
+        elif status["status"] == "sent" and not checkpointed:
+            unchecked += 1
+        if sum(int(status.get(f"{o}_count", 0)) for o in FINAL_OUTCOMES) != devices:
+            uncounted += 1
+    return {
+        "not_final_status": not_final,
+        "uncounted_outcomes": uncounted,
+        "sent_without_checkpoint": unchecked,
+        "invalid": invalid,
+        "deactivated": deactivated,
+        "ok": not (not_final or uncounted or unchecked) and invalid == deactivated,
+    }
+
+
+def run_blocking_case(
+    loop, redis, check_redis, base_url: str, keys: list[dict], messages: int, devices: int, idle_seconds: float
+) -> dict:
+    from app.consumer import handle_delivery
+
+    channel = FakeChannel()
+    notification_ids = []
+    for notification_id, body in _make_messages(base_url, keys, messages, devices):
+        notification_ids.append(notification_id)
+        channel.publish(body)
+
+    before = _outcome_totals()
+    deactivated_before = _deactivated_tokens(base_url)
+    started = time.perf_counter()
+    # One delivery at a time, like the pika callback; the loop only runs inside handle_delivery
+    while channel.queue:
+        method, properties, body = channel.deliver()
+        handle_delivery(loop, redis, channel, method, properties, body)
+    elapsed = time.perf_counter() - started
+    after = _outcome_totals()
+
+    # Whatever is still buffered now stays there: nothing runs the loop while the queue is quiet
+    time.sleep(idle_seconds)
+    outcomes = {o: int(after[o] - before[o]) for o in OUTCOMES}
+    idle_check = _idle_check(
+        check_redis, notification_ids, devices, outcomes["invalid"], _deactivated_tokens(base_url) - deactivated_before
+    )
+
+    return {
+        "mode": "blocking",
+        "devices_per_message": devices,
+        "concurrency": 1,
+        "messages": messages,
+        "devices": messages * devices,
+        "seconds": elapsed,
+        "messages_per_sec": messages / elapsed,
+        "devices_per_sec": messages * devices / elapsed,
+        "latency_ms": _summary(channel.latencies),
+        "end_to_end_ms": _summary(channel.end_to_end),
+        "outcomes": outcomes,
+        "retries": channel.retries,
+        "parked": channel.parked,
+        "nacks": channel.nacks,
+        "idle_check": idle_check,
+    }
+
+
+def _configure_env(args, port: int):
+    """The app reads its configuration at import time, so set it before importing."""
+    os.environ["USER_SERVICE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["WEBPUSH_TRANSPORT"] = args.transport
+    os.environ["WEBPUSH_HTTP2"] = "false"  # the fake push service speaks HTTP/1.1
+    os.environ["ENCRYPTION_WORKERS"] = str(args.encryption_workers)
+    os.environ["PUSH_PROCESS_CONCURRENCY"] = str(args.process_concurrency)
+    os.environ["PUSH_MESSAGE_CONCURRENCY"] = str(args.message_concurrency)
+    if not os.getenv("VAPID_PRIVATE_KEY"):
+        from py_vapid import Vapid
+        from py_vapid.utils import b64urlencode
+        vapid = Vapid()
+        vapid.generate_keys()
+        os.environ["VAPID_PRIVATE_KEY"] = b64urlencode(vapid.private_key.private_numbers().private_value.to_bytes(32, "big"))
+        os.environ.setdefault("VAPID_PUBLIC_KEY", "bench")
+        os.environ.setdefault("VAPID_EMAIL", "bench@example.com")
+
+
+def _print_row(result: dict):
+    latency = result["latency_ms"]
+    print(
+        f"{result['mode']:>9}{result['devices_per_message']:>8}{result['concurrency']:>8}"
+        f"{result['messages_per_sec']:>12.1f}{result['devices_per_sec']:>12.1f}"
+        f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}"
+    )
+    idle_check = result.get("idle_check")
+    if idle_check and not idle_check["ok"]:
+        print(f"  idle check failed: {idle_check}", file=sys.stderr)
+
+
+async def bench(args, port: int) -> list[dict]:
+    from app.status_writer import close_status_writer
+    from app.user_client import close_user_client
+    from app.webpush_client import close_webpush_transport
+    from benchmarks.bench_encryption import make_subscription_keys
+
+    if args.redis_url:
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        import fakeredis
+        redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+
+    base_url = f"http://127.0.0.1:{port}"
+    keys = make_subscription_keys(64)
+    results = []
+    try:
+        # Warm up connection pools and VAPID signing
+        await run_case(redis, base_url, keys, 10, 2, 4)
+        for devices in args.devices:
+            for concurrency in args.concurrency:
+                result = await run_case(redis, base_url, keys, args.messages, devices, concurrency)
+                results.append(result)
+                _print_row(result)
+    finally:
+        await close_user_client()
+        await close_webpush_transport()
+        await close_status_writer()
+        await redis.aclose()
+    return results
+
+
+def bench_blocking(args, port: int) -> list[dict]:
+    """
+    The blocking consumer's path: its own event loop that only runs inside
+    handle_delivery, one message in flight, and an idle check per run.
+    """
+    import app.consumer as consumer
+    from app.status_writer import close_status_writer
+    from app.user_client import close_user_client
+    from app.webpush_client import close_webpush_transport
+    from benchmarks.bench_encryption import make_subscription_keys
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # The process-wide send limiter may still be bound to the asyncio runs' loop
+    consumer._process_send_limiter = None
+
+    if args.redis_url:
+        import redis as sync_redis
+        from redis.asyncio import Redis
+        redis = Redis.from_url(args.redis_url, decode_responses=True)
+        check_redis = sync_redis.Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        redis = fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+        check_redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+
+    base_url = f"http://127.0.0.1:{port}"
+    keys = make_subscription_keys(64)
+    results = []
+    try:
+        # Warm up connection pools and VAPID signing
+        run_blocking_case(loop, redis, check_redis, base_url, keys, 10, 2, 0)
+        for devices in args.devices:
+            result = run_blocking_case(loop, redis, check_redis, base_url, keys, args.messages, devices, args.idle_seconds)
+            results.append(result)
+            _print_row(result)
+    finally:
+        loop.run_until_complete(close_user_client())
+        loop.run_until_complete(close_webpush_transport())
+        loop.run_until_complete(close_status_writer())
+        loop.run_until_complete(redis.aclose())
+        check_redis.close()
+        loop.close()
+    return results
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def _mode_list(value: str) -> list[str]:
+    modes = [v for v in value.split(",") if v]
+    for mode in modes:
+        if mode not in MODES:
+            raise argparse.ArgumentTypeError(f"unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    return modes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200, help="messages per run")
+    parser.add_argument("--devices", type=_int_list, default=[1, 10, 100], help="devices per message, comma separated")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 10, 50], help="messages in flight, comma separated")
+    parser.add_argument(
+        "--modes", type=_mode_list, default=list(MODES),
+        help="consumer paths to run, comma separated (blocking runs one message in flight, --concurrency does not apply)",
+    )
+    parser.add_argument(
+        "--idle-seconds", type=float, default=1.5,
+        help="blocking runs: how long the consumer sits idle before stored status and checkpoints are checked",
+    )
+    parser.add_argument("--latency-ms", type=float, default=20, help="fake push service response delay")
+    parser.add_argument(
+        "--mix", default="201=0.95,410=0.03,500=0.02",
+        help="response status weights; any 429 pauses the single fake origin for its Retry-After",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--transport", choices=("httpx", "pywebpush"), default="httpx")
+    parser.add_argument("--encryption-workers", type=int, default=0)
+    parser.add_argument("--process-concurrency", type=int, default=64, help="PUSH_PROCESS_CONCURRENCY")
+    parser.add_argument("--message-concurrency", type=int, default=8, help="PUSH_MESSAGE_CONCURRENCY")
+    parser.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    parser.add_argument("--log-level", default="CRITICAL", help="app log level (send failures log at ERROR)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    server, port = start_fake_push_service(args.latency_ms, args.mix, args.seed)
+    try:
+        _configure_env(args, port)
+        from loguru import logger
+        logger.remove()
+        logger.add(sys.stderr, level=args.log_level)
+
+        print(f"{'mode':>9}{'devices':>8}{'conc':>8}{'msg/s':>12}{'dev/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        results = []
+        if "asyncio" in args.modes:
+            results += asyncio.run(bench(args, port))
+        if "blocking" in args.modes:
+            results += bench_blocking(args, port)
+    finally:
+        server.terminate()
+        server.join()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "config": {
+                    "messages": args.messages,
+                    "latency_ms": args.latency_ms,
+                    "mix": args.mix,
+                    "transport": args.transport,
+                    "encryption_workers": args.encryption_workers,
+                    "process_concurrency": args.process_concurrency,
+                    "message_concurrency": args.message_concurrency,
+                    "redis": "redis" if args.redis_url else "fakeredis",
+                    "modes": args.modes,
+                    "idle_seconds": args.idle_seconds,
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
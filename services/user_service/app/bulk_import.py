@@ -0,0 +1,318 @@
+"""
+Bulk user import from CSV or NDJSON.
+
+Rows are validated like POST /api/v1/users/, emails that already exist
+are skipped with one SELECT per batch, the remaining passwords are hashed
+on the shared worker pool, and users, devices and preferences are written
+with one multi-row INSERT ... ON CONFLICT DO NOTHING per table per batch.
+Bad rows (invalid fields, duplicate emails) are reported and skipped;
+they never abort the rest of the batch.
+
+CSV columns: name,email,password[,push_token,platform,email_enabled,push_enabled]
+NDJSON lines: the POST /api/v1/users/ body (preferences optional), plus an optional "platform".
+
+CLI (run from services/user_service):
+
+    python -m app.bulk_import users.csv --batch-size 1000 --warm-cache
+"""
+import os
+import csv
+import json
+import codecs
+import asyncio
+import logging
+import argparse
+from typing import AsyncIterator, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import User, Device, NotificationPreference, gen_uuid
+from .schemas import UserCreate
+from .utils import hash_passwords_async
+from .cache import USER_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# Rows written per transaction (one multi-row INSERT per table)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# Per-row errors returned in the report (all of them are still counted)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Keeps the preferences INSERT (2 rows x 4 columns per user) under the 32767 bind-parameter limit
+MAX_IMPORT_BATCH_SIZE = 4000
+
+CSV_REQUIRED_COLUMNS = {"name", "email", "password"}
+
+
+class ImportFormatError(ValueError):
+    """The input cannot be parsed at all (unknown format, bad CSV header)."""
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a stream of UTF-8 byte chunks into lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+def _csv_row(header: list[str], line: str) -> dict:
+    values = next(csv.reader([line]))
+    raw = {column: value.strip() for column, value in zip(header, values) if value.strip() != ""}
+    preferences = {}
+    for channel in ("email", "push"):
+        if f"{channel}_enabled" in raw:
+            preferences[channel] = raw.pop(f"{channel}_enabled")
+    raw["preferences"] = preferences
+    return raw
+
+
+async def iter_rows(lines: AsyncIterator[str], fmt: str) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """Yield (line number, raw row, parse error) for every non-blank data line."""
+    if fmt not in ("csv", "ndjson"):
+        raise ImportFormatError(f"Unsupported import format: {fmt}")
+
+    header = None
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        if fmt == "csv" and header is None:
+            header = [column.strip().lower() for column in next(csv.reader([line]))]
+            missing = CSV_REQUIRED_COLUMNS - set(header)
+            if missing:
+                raise ImportFormatError(f"CSV header is missing column(s): {', '.join(sorted(missing))}")
+            continue
+        try:
+            if fmt == "csv":
+                row = _csv_row(header, line)
+            else:
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+                row.setdefault("preferences", {})
+        except (ValueError, csv.Error) as e:
+            yield line_no, None, f"unparseable row: {e}"
+            continue
+        yield line_no, row, None
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc'])}: {e['msg']}" for e in error.errors())
+
+
+def _dialect_insert(session: AsyncSession):
+    """INSERT construct with ON CONFLICT support for the session's database."""
+    if session.bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert
+
+
+class _Importer:
+    def __init__(self, session: AsyncSession, redis, warm_cache: bool):
+        self.session = session
+        self.redis = redis if warm_cache else None
+        self.seen_emails: set[str] = set()
+        self.seen_tokens: set[str] = set()
+        self.report = {"total": 0, "created": 0, "failed": 0, "devices_created": 0, "devices_skipped": 0, "errors": [], "errors_truncated": False}
+
+    def error(self, line_no: int, email: Optional[str], message: str):
+        self.report["failed"] += 1
+        if len(self.report["errors"]) < IMPORT_MAX_ERRORS:
+            self.report["errors"].append({"row": line_no, "email": email, "error": message})
+        else:
+            self.report["errors_truncated"] = True
+
+    def validate(self, line_no: int, row: dict) -> Optional[tuple[int, UserCreate, str]]:
+        platform = row.pop("platform", None) or "unknown"
+        try:
+            user = UserCreate.model_validate(row)
+        except ValidationError as e:
+            self.error(line_no, row.get("email"), _validation_message(e))
+            return None
+        if user.email in self.seen_emails:
+            self.error(line_no, user.email, "duplicate email in import")
+            return None
+        self.seen_emails.add(user.email)
+        return line_no, user, platform
+
+    def fail_batch(self, batch: list[tuple[int, UserCreate, str]], error: Exception):
+        logger.error("Bulk import batch of %d row(s) failed", len(batch), exc_info=error)
+        for line_no, user, _ in batch:
+            self.error(line_no, user.email, f"batch failed: {type(error).__name__}")
+
+    async def write_batch(self, batch: list[tuple[int, UserCreate, str]]):
+        insert = _dialect_insert(self.session)
+
+        # Skip emails that are already registered (re-runs, overlapping imports) before paying for bcrypt
+        try:
+            result = await self.session.execute(select(User.email).where(User.email.in_([user.email for _, user, _ in batch])))
+            existing = set(result.scalars())
+        except Exception as e:
+            await self.session.rollback()
+            self.fail_batch(batch, e)
+            return
+        for line_no, user, _ in batch:
+            if user.email in existing:
+                self.error(line_no, user.email, "user_exists")
+        batch = [row for row in batch if row[1].email not in existing]
+        if not batch:
+            await self.session.commit()
+            return
+
+        hashes = await hash_passwords_async([user.password for _, user, _ in batch])
+        ids = [gen_uuid() for _ in batch]
+
+        try:
+            result = await self.session.execute(
+                insert(User)
+                .values([
+                    {"id": user_id, "name": user.name, "email": user.email, "password": password_hash}
+                    for user_id, (_, user, _), password_hash in zip(ids, batch, hashes)
+                ])
+                .on_conflict_do_nothing(index_elements=["email"])
+                .returning(User.id)
+            )
+            created_ids = {row[0] for row in result}
+
+            created = [(user_id, line_no, user, platform) for user_id, (line_no, user, platform) in zip(ids, batch) if user_id in created_ids]
+            devices = []
+            for user_id, line_no, user, platform in created:
+                if user.push_token:
+                    if user.push_token in self.seen_tokens:
+                        continue
+                    self.seen_tokens.add(user.push_token)
+                    devices.append({"id": gen_uuid(), "user_id": user_id, "device_token": user.push_token, "platform": platform, "is_active": True})
+            device_owners = set()
+            if devices:
+                result = await self.session.execute(
+                    insert(Device).values(devices).on_conflict_do_nothing(index_elements=["device_token"]).returning(Device.user_id)
+                )
+                device_owners = {row[0] for row in result}
+
+            if created:
+                await self.session.execute(
+                    insert(NotificationPreference).values([
+                        {"id": gen_uuid(), "user_id": user_id, "channel": channel, "enabled": getattr(user.preferences, channel)}
+                        for user_id, _, user, _ in created
+                        for channel in ("email", "push")
+                    ])
+                )
+            await self.session.commit()
+        except Exception as e:
+            await self.session.rollback()
+            self.fail_batch(batch, e)
+            return
+
+        self.report["created"] += len(created)
+        self.report["devices_created"] += len(device_owners)
+        # Tokens already registered (or repeated in the import) keep their existing device
+        self.report["devices_skipped"] += sum(1 for _, _, user, _ in created if user.push_token) - len(device_owners)
+        for user_id, (line_no, user, _) in zip(ids, batch):
+            if user_id not in created_ids:
+                self.error(line_no, user.email, "user_exists")
+
+        if self.redis and created:
+            await self.warm(created, device_owners)
+
+    async def warm(self, created, device_owners: set[str]):
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id, _, user, _ in created:
+                    profile = {
+                        "id": user_id,
+                        "name": user.name,
+                        "email": user.email,
+                        "push_tokens": [user.push_token] if user_id in device_owners else [],
+                        "preferences": {"email": user.preferences.email, "push": user.preferences.push},
+                    }
+                    pipe.setex(f"user:{user_id}", USER_CACHE_TTL, json.dumps(profile))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Redis cache warm failed: %s", e)
+
+
+async def import_users(
+    lines: AsyncIterator[str],
+    fmt: str,
+    session: AsyncSession,
+    redis=None,
+    warm_cache: bool = False,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> dict:
+    """
+    Import users from CSV/NDJSON `lines`, committing every `batch_size` rows.
+    Returns a report with created/failed counts and per-row errors.
+    Raises ImportFormatError if the input cannot be parsed at all.
+    """
+    batch_size = max(1, min(batch_size, MAX_IMPORT_BATCH_SIZE))
+    importer = _Importer(session, redis, warm_cache)
+    batch = []
+    async for line_no, row, parse_error in iter_rows(lines, fmt):
+        importer.report["total"] += 1
+        if parse_error:
+            importer.error(line_no, None, parse_error)
+            continue
+        valid = importer.validate(line_no, row)
+        if valid:
+            batch.append(valid)
+        if len(batch) >= batch_size:
+            await importer.write_batch(batch)
+            batch = []
+    if batch:
+        await importer.write_batch(batch)
+
+    logger.info(
+        "Bulk import finished: total=%d created=%d failed=%d",
+        importer.report["total"], importer.report["created"], importer.report["failed"],
+    )
+    return importer.report
+
+
+async def _file_chunks(path: str, chunk_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+async def _main(args):
+    from .db import SessionLocal
+    from .redis_client import init_redis
+
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    redis = await init_redis() if args.warm_cache else None
+    try:
+        async with SessionLocal() as session:
+            report = await import_users(
+                iter_lines(_file_chunks(args.path)), fmt, session,
+                redis=redis, warm_cache=args.warm_cache, batch_size=args.batch_size,
+            )
+    finally:
+        if redis:
+            await redis.aclose()
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV or NDJSON file")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    parser.add_argument("--warm-cache", action="store_true", help="write user:{id} profiles to Redis")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
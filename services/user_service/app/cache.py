@@ -0,0 +1,248 @@
+import os
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# TTL (seconds) of cached user profiles in Redis (user:{id})
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))
+
+# In-process (L1) cache in front of the user:{id} Redis entries
+USER_L1_CACHE_SIZE = int(os.getenv("USER_L1_CACHE_SIZE", "10000"))
+USER_L1_CACHE_TTL = float(os.getenv("USER_L1_CACHE_TTL", "30"))
+USER_CACHE_CHANNEL = os.getenv("USER_CACHE_CHANNEL", "user-cache:invalidate")
+
+# Users written within this many seconds are read from the primary, not the (possibly lagging) replica
+DB_READ_AFTER_WRITE_SECONDS = float(os.getenv("DB_READ_AFTER_WRITE_SECONDS", "5"))
+
+# Probabilistic early refresh: larger beta refreshes hot keys earlier before they expire
+USER_CACHE_EARLY_REFRESH_BETA = float(os.getenv("USER_CACHE_EARLY_REFRESH_BETA", "1.0"))
+
+
+class UserCache:
+    """
+    Bounded LRU cache with per-entry TTL for user profiles.
+    Every invalidation bumps the user's version; a `set` that started before
+    an invalidation of that user is dropped so a stale read can never
+    repopulate the cache. Writes to other users do not affect it.
+    Recent invalidations are remembered for `write_window` seconds so loads
+    can avoid a read replica that may not have the write yet.
+    """
+
+    def __init__(self, maxsize: int = USER_L1_CACHE_SIZE, ttl: float = USER_L1_CACHE_TTL, write_window: float = DB_READ_AFTER_WRITE_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.write_window = write_window
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._recent_writes: OrderedDict[str, float] = OrderedDict()
+        self._cleared_at = -write_window
+        # Per-user versions: the sequence number of the user's last invalidation.
+        # Users without an entry (never invalidated, or pruned) are at `_version_floor`.
+        self._sequence = 0
+        self._versions: OrderedDict[str, int] = OrderedDict()
+        self._version_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def version(self, user_id: str) -> int:
+        """Read before loading `user_id`; pass to `set` so a load that raced an invalidation is dropped."""
+        return self._versions.get(user_id, self._version_floor)
+
+    def _bump_versions(self, user_ids):
+        for user_id in user_ids:
+            self._sequence += 1
+            self._versions[user_id] = self._sequence
+            self._versions.move_to_end(user_id)
+        # Bounded: pruned users fall back to the floor, which is at least their old version,
+        # so a pruned user's version never goes back (at worst an in-flight fill is dropped)
+        limit = max(1024, 2 * self.maxsize)
+        while len(self._versions) > limit:
+            _, pruned = self._versions.popitem(last=False)
+            self._version_floor = max(self._version_floor, pruned)
+
+    def get(self, user_id: str) -> dict | None:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, user_id: str, profile: dict, version: int | None = None):
+        """Cache `profile`; skipped if `user_id` was invalidated since `version` was read."""
+        if self.maxsize <= 0 or (version is not None and version != self.version(user_id)):
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *user_ids: str):
+        self._bump_versions(user_ids)
+        now = time.monotonic()
+        for user_id in user_ids:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+            self._recent_writes[user_id] = now
+            self._recent_writes.move_to_end(user_id)
+        while self._recent_writes and next(iter(self._recent_writes.values())) <= now - self.write_window:
+            self._recent_writes.popitem(last=False)
+
+    def recently_written(self, user_id: str) -> bool:
+        """True if `user_id` (or, after a resubscribe, anyone) may have been written within the window."""
+        now = time.monotonic()
+        if now - self._cleared_at < self.write_window:
+            return True
+        written = self._recent_writes.get(user_id)
+        return written is not None and now - written < self.write_window
+
+    def clear(self):
+        # Invalidations may have been missed: treat every user as recently written
+        self._cleared_at = time.monotonic()
+        # Every user's version moves past anything read before the clear
+        self._sequence += 1
+        self._version_floor = self._sequence
+        self._versions.clear()
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "loads_in_flight": profile_loads.in_flight(),
+            "loads_coalesced": profile_loads.coalesced,
+            "load_seconds_avg": round(profile_load_timer.average, 6),
+        }
+
+
+user_cache = UserCache()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent loads of the same key: the first caller starts the
+    load, later callers await the same result. Waiters are shielded, so a
+    cancelled request does not cancel the load for everyone else.
+    """
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    def _start(self, key: str, load) -> asyncio.Future:
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(load())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return future
+
+    async def do(self, key: str, load):
+        """Run `load()` for `key` unless a load is already in flight, and return its result."""
+        return await asyncio.shield(self._start(key, load))
+
+    def spawn(self, key: str, load):
+        """Start `load()` in the background unless one is already in flight for `key`."""
+        future = self._start(key, load)
+        future.add_done_callback(_log_background_failure)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+def _log_background_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception():
+        logger.warning("Background cache refresh failed: %s", future.exception())
+
+
+class LoadTimer:
+    """Exponentially weighted moving average of how long a cache rebuild takes."""
+
+    def __init__(self, alpha: float = 0.2, initial: float = 0.01):
+        self.alpha = alpha
+        self.average = initial
+
+    def observe(self, seconds: float):
+        self.average += self.alpha * (seconds - self.average)
+
+
+def should_refresh_early(remaining_ttl: float, rebuild_seconds: float, beta: float = USER_CACHE_EARLY_REFRESH_BETA) -> bool:
+    """
+    XFetch ("optimal probabilistic cache stampede prevention"): refresh with
+    a probability that rises as expiry approaches, scaled by rebuild cost.
+    A negative `remaining_ttl` is Redis PTTL's "no TTL" (-1) or "key gone
+    since the GET" (-2): nothing is about to expire, so no early refresh.
+    """
+    if remaining_ttl < 0:
+        return False
+    if remaining_ttl == 0:
+        return True
+    return -rebuild_seconds * beta * math.log(1.0 - random.random()) >= remaining_ttl
+
+
+# One in-flight DB load per user per process, and the average cost of a load
+profile_loads = SingleFlight()
+profile_load_timer = LoadTimer()
+
+
+async def invalidate_users(redis, user_ids):
+    """
+    Drop cached profiles everywhere: locally, in Redis, and on every other
+    replica through a pub/sub broadcast (delete + publish in one round trip).
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    user_cache.invalidate(*user_ids)
+    if redis:
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.delete(*[f"user:{user_id}" for user_id in user_ids])
+                pipe.publish(USER_CACHE_CHANNEL, json.dumps(user_ids))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning("Redis cache invalidation failed: %s", e)
+
+
+async def listen_for_invalidations(redis):
+    """Apply invalidations broadcast by other replicas; runs for the app's lifetime."""
+    while True:
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(USER_CACHE_CHANNEL)
+            # Anything published while we were not subscribed is lost, so start clean
+            user_cache.clear()
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    user_cache.invalidate(*json.loads(message["data"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("User cache invalidation listener failed: %s, resubscribing in 1s", e)
+            await asyncio.sleep(1)
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
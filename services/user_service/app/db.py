@@ -1,16 +1,118 @@
 import os
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import time
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Optional read replica for read-only routes; falls back to the primary when unset
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def recreate(self):
+        # Keep the class (and its counters) when the engine invalidates the pool
+        pool = super().recreate()
+        pool.checkouts, pool.timeouts = self.checkouts, self.timeouts
+        pool.wait_seconds_total, pool.wait_seconds_max = self.wait_seconds_total, self.wait_seconds_max
+        return pool
+
+    def stats(self) -> dict:
+        capacity = self.size() + max(self._max_overflow, 0)
+        checked_out = self.checkedout()
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_out": checked_out,
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "utilization": round(checked_out / capacity, 4) if capacity else 0.0,
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            "wait_seconds_max": round(self.wait_seconds_max, 6),
+        }
+
+
+def _create_engine(url: str, prefix: str) -> AsyncEngine:
+    """
+    Engine with pool settings from {prefix}POOL_SIZE, {prefix}MAX_OVERFLOW,
+    {prefix}POOL_TIMEOUT, {prefix}POOL_RECYCLE, {prefix}POOL_PRE_PING and
+    {prefix}STATEMENT_CACHE_SIZE (asyncpg prepared statements per connection).
+    """
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        # Local/dev databases keep SQLAlchemy's default sqlite pooling
+        return create_async_engine(url, echo=False, future=True)
+
+    options = {
+        "poolclass": InstrumentedPool,
+        "pool_size": int(os.getenv(f"{prefix}POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv(f"{prefix}MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv(f"{prefix}POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv(f"{prefix}POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv(f"{prefix}POOL_PRE_PING", "true").lower() == "true",
+    }
+    statement_cache_size = os.getenv(f"{prefix}STATEMENT_CACHE_SIZE")
+    if statement_cache_size is not None and url.get_driver_name() == "asyncpg":
+        # 0 is required behind PgBouncer in transaction pooling mode
+        url = url.update_query_dict({"prepared_statement_cache_size": statement_cache_size})
+        options["connect_args"] = {"statement_cache_size": int(statement_cache_size)}
+    return create_async_engine(url, echo=False, future=True, **options)
+
+
+engine = _create_engine(DATABASE_URL, "DB_")
+read_engine = _create_engine(DATABASE_READ_URL, "DB_READ_") if DATABASE_READ_URL else engine
 
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
 SessionLocal = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
 async def get_db():
     async with SessionLocal() as session:
         yield session
+
+async def get_read_db():
+    """Session on the read replica (the primary when no replica is configured)."""
+    async with ReadSessionLocal() as session:
+        yield session
+
+def has_read_replica() -> bool:
+    return read_engine is not engine
+
+def pool_stats() -> dict:
+    """Checkout wait and utilization of every engine's connection pool."""
+    engines = {"primary": engine}
+    if has_read_replica():
+        engines["replica"] = read_engine
+    return {
+        name: pool.stats() if isinstance(pool := eng.pool, InstrumentedPool) else {"status": pool.status()}
+        for name, eng in engines.items()
+    }
@@ -1,6 +1,8 @@
+import asyncio
 from fastapi import FastAPI
 from .db import Base, engine
 from .redis_client import init_redis, get_redis_client_sync
+from .cache import listen_for_invalidations
 
 from app.routes import users, status, health
 
@@ -13,11 +15,20 @@ async def startup():
         await conn.run_sync(Base.metadata.create_all)
     
     # Initialize Redis
-    await init_redis()
+    redis = await init_redis()
     
     # Fail fast if Redis not ready
     get_redis_client_sync()
 
+    # Drop in-process cached users when any replica invalidates them
+    app.state.cache_listener = asyncio.create_task(listen_for_invalidations(redis))
+
+@app.on_event("shutdown")
+async def shutdown():
+    listener = getattr(app.state, "cache_listener", None)
+    if listener:
+        listener.cancel()
+
 # Include routers
 app.include_router(users.router)
 app.include_router(status.router)
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 from app.redis_client import redis_client as redis
-from ..db import engine
+from ..db import engine, pool_stats
+from ..cache import user_cache
 import datetime
 
 router = APIRouter(tags=["health"])
@@ -27,3 +28,15 @@ async def health_check():
 
     result["uptime"] = str(datetime.datetime.utcnow())
     return result
+
+
+@router.get("/health/cache")
+async def cache_stats():
+    # In-process user cache counters for this replica
+    return user_cache.stats()
+
+
+@router.get("/health/db")
+async def db_pool_stats():
+    # Connection pool checkout wait and utilization per engine (primary / replica)
+    return pool_stats()
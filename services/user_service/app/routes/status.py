@@ -20,11 +20,11 @@ async def update_status(
         "updatedAt": timestamp
     }
 
-    # Redis hash
-  
-    await redis.hset(key, mapping=mapping)
-    # Set TTL for 7 days
-    await redis.expire(key, 3600 * 24 * 7)
+    # Redis hash + TTL for 7 days, in a single round trip
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, 3600 * 24 * 7)
+        await pipe.execute()
 
     return {
         "success": True,
@@ -1,17 +1,24 @@
+import os
 import json
+import time
 import logging
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.future import select
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import text
+from sqlalchemy import text, update, and_, or_
 
-from ..db import get_db
+from ..db import get_db, get_read_db, SessionLocal, ReadSessionLocal
 from ..models import User, Device, NotificationPreference
-from ..schemas import UserCreate, UserResponse, DeviceCreate, PreferenceUpdate
-from ..utils import hash_password
-from app.redis_client import redis_client as redis
+from ..schemas import UserCreate, UserResponse, UserBatchRequest, DeviceCreate, DeviceDeactivateBatch, PreferenceUpdate
+from ..utils import hash_password_async, PasswordHasherBusy
+from ..bulk_import import import_users as run_import, iter_lines, ImportFormatError
+from app.redis_client import get_redis
+from app.cache import USER_CACHE_TTL, user_cache, invalidate_users, profile_loads, profile_load_timer, should_refresh_early
 
 router = APIRouter(prefix="/api/v1/users", tags=["users"])
 
@@ -19,14 +26,24 @@ router = APIRouter(prefix="/api/v1/users", tags=["users"])
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Rows per keyset page of the device export
+DEVICE_EXPORT_PAGE_SIZE = int(os.getenv("DEVICE_EXPORT_PAGE_SIZE", "5000"))
+
 
 @router.post("/", status_code=201)
-async def create_user(payload: UserCreate, db: AsyncSession = Depends(get_db)):
+async def create_user(payload: UserCreate, db: AsyncSession = Depends(get_db), redis = Depends(get_redis)):
+    # Hash off the event loop; shed load instead of queueing unboundedly
+    try:
+        password_hash = await hash_password_async(payload.password)
+    except PasswordHasherBusy:
+        logger.warning("Password hashing queue full, rejecting signup for %s", payload.email)
+        raise HTTPException(status_code=503, detail="server_busy", headers={"Retry-After": "1"})
+
     try:
         user = User(
             name=payload.name,
             email=payload.email,
-            password=hash_password(payload.password)
+            password=password_hash
         )
         db.add(user)
         await db.flush()  # to populate user.id
@@ -61,7 +78,7 @@ async def create_user(payload: UserCreate, db: AsyncSession = Depends(get_db)):
         # Cache user safely
         if redis:
             try:
-                await redis.setex(f"user:{user.id}", 300, json.dumps(response))
+                await redis.setex(f"user:{user.id}", USER_CACHE_TTL, json.dumps(response))
             except Exception as e:
                 logger.warning("Redis cache set failed: %s", e)
 
@@ -83,14 +100,177 @@ async def create_user(payload: UserCreate, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=500, detail="internal_error")
 
 
+@router.post("/import")
+async def import_users(
+    request: Request,
+    format: Optional[str] = Query(default=None, pattern="^(csv|ndjson)$"),
+    warm_cache: bool = False,
+    db: AsyncSession = Depends(get_db),
+    redis = Depends(get_redis)
+):
+    """
+    Bulk-create users from a CSV or NDJSON request body, streamed and written
+    in batches. The format defaults to the Content-Type (text/csv or NDJSON).
+    Rows that fail are listed in `data.errors`; the rest are still imported.
+    """
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    try:
+        report = await run_import(iter_lines(request.stream()), fmt, db, redis=redis, warm_cache=warm_cache)
+    except ImportFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "success": True,
+        "data": report,
+        "error": None,
+        "message": f"Imported {report['created']} of {report['total']} users",
+        "meta": None
+    }
+
+
+def _profile_query():
+    """User with active devices and preferences, eager-loaded in one SQL round trip."""
+    return select(User).options(
+        joinedload(User.devices.and_(Device.is_active == True)),
+        joinedload(User.preferences),
+    )
+
+
+def _build_profile(user: User) -> dict:
+    pref_map = {p.channel: p.enabled for p in user.preferences}
+    return {
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "push_tokens": [d.device_token for d in user.devices],
+        "preferences": {"email": pref_map.get("email", True), "push": pref_map.get("push", True)}
+    }
+
+
+async def _query_profiles(session: AsyncSession, user_ids: List[str]) -> dict:
+    result = await session.execute(_profile_query().where(User.id.in_(user_ids)))
+    return {user.id: _build_profile(user) for user in result.unique().scalars().all()}
+
+
+@router.post("/batch")
+async def get_users_batch(body: UserBatchRequest, db: AsyncSession = Depends(get_read_db), redis = Depends(get_redis)):
+    """
+    Resolve many users at once: the in-process cache first, then one Redis
+    MGET for cached profiles and one SQL IN query (on the read replica) for
+    the misses, which are then cached in one pipeline.
+    """
+    user_ids = list(dict.fromkeys(body.user_ids))
+    versions = {user_id: user_cache.version(user_id) for user_id in user_ids}
+    profiles = {}
+    for user_id in user_ids:
+        profile = user_cache.get(user_id)
+        if profile is not None:
+            profiles[user_id] = profile
+
+    remote = [user_id for user_id in user_ids if user_id not in profiles]
+    if redis and remote:
+        try:
+            cached = await redis.mget([f"user:{user_id}" for user_id in remote])
+            for user_id, raw in zip(remote, cached):
+                if raw:
+                    profiles[user_id] = json.loads(raw)
+                    user_cache.set(user_id, profiles[user_id], versions[user_id])
+        except Exception as e:
+            logger.warning("Redis cache fetch failed: %s", e)
+    cache_hits = len(profiles)
+
+    misses = [user_id for user_id in user_ids if user_id not in profiles]
+    if misses:
+        # Users written moments ago may not be on the replica yet
+        fresh = [user_id for user_id in misses if user_cache.recently_written(user_id)]
+        replica = [user_id for user_id in misses if not user_cache.recently_written(user_id)]
+        loaded = await _query_profiles(db, replica) if replica else {}
+        if fresh:
+            async with SessionLocal() as primary:
+                loaded.update(await _query_profiles(primary, fresh))
+        profiles.update(loaded)
+        for user_id, profile in loaded.items():
+            user_cache.set(user_id, profile, versions[user_id])
+
+        # Cache safely
+        if redis and loaded:
+            try:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for user_id, profile in loaded.items():
+                        pipe.setex(f"user:{user_id}", USER_CACHE_TTL, json.dumps(profile))
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("Redis cache set failed: %s", e)
+
+    return {
+        "success": True,
+        "data": {
+            "users": [profiles[user_id] for user_id in user_ids if user_id in profiles],
+            "not_found": [user_id for user_id in user_ids if user_id not in profiles]
+        },
+        "error": None,
+        "message": "Users retrieved successfully",
+        "meta": {"requested": len(user_ids), "cache_hits": cache_hits}
+    }
+
+
+async def _load_profile(redis, user_id: str, version: int) -> dict | None:
+    """
+    Rebuild one user's profile from the DB and write it to both caches.
+    Uses its own session: the load is shared by every coalesced caller and
+    may outlive the request that started it. Reads go to the replica unless
+    the user was written too recently for the replica to have caught up.
+    """
+    started = time.perf_counter()
+    session_factory = SessionLocal if user_cache.recently_written(user_id) else ReadSessionLocal
+    async with session_factory() as session:
+        # Fetch user, active devices and preferences from DB in one query
+        result = await session.execute(_profile_query().where(User.id == user_id))
+        user = result.unique().scalars().first()
+    profile_load_timer.observe(time.perf_counter() - started)
+    if not user:
+        return None
+
+    profile = _build_profile(user)
+    user_cache.set(user_id, profile, version)
+
+    # Cache safely
+    if redis:
+        try:
+            await redis.setex(f"user:{user_id}", USER_CACHE_TTL, json.dumps(profile))
+        except Exception as e:
+            logger.warning("Redis cache set failed: %s", e)
+    return profile
+
+
 @router.get("/{user_id}")
-async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
-    # Attempts to fetch from Redis cache first
+async def get_user(user_id: str, redis = Depends(get_redis)):
+    # In-process cache first (invalidated across replicas via Redis pub/sub)
+    version = user_cache.version(user_id)
+    # Loads started before an invalidation of this user are never joined by later callers
+    load_key = f"{user_id}@{version}"
+    response_data = user_cache.get(user_id)
+    if response_data is not None:
+        return {
+            "success": True,
+            "data": response_data,
+            "error": None,
+            "message": "User retrieved from cache",
+            "meta": None
+        }
+
+    # Then the shared Redis cache; hot keys are rebuilt in the background before they expire
     if redis:
         try:
-            cached = await redis.get(f"user:{user_id}")
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.get(f"user:{user_id}")
+                pipe.pttl(f"user:{user_id}")
+                cached, ttl_ms = await pipe.execute()
             if cached:
                 response_data = json.loads(cached)
+                user_cache.set(user_id, response_data, version)
+                if should_refresh_early(ttl_ms / 1000, profile_load_timer.average):
+                    profile_loads.spawn(load_key, lambda: _load_profile(redis, user_id, version))
                 return {
                     "success": True,
                     "data": response_data,
@@ -101,37 +281,11 @@ async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
         except Exception as e:
             logger.warning("Redis cache fetch failed: %s", e)
 
-    # Fetch from DB if not cached
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalars().first()
-    if not user:
+    # Cache miss: only one DB load per user is in flight, concurrent callers share it
+    response = await profile_loads.do(load_key, lambda: _load_profile(redis, user_id, version))
+    if not response:
         raise HTTPException(status_code=404, detail="user_not_found")
 
-    # Get active device tokens
-    result = await db.execute(select(Device).where(Device.user_id == user_id, Device.is_active == True))
-    devices = result.scalars().all()
-    push_tokens = [d.device_token for d in devices]
-
-    # Get preferences
-    result = await db.execute(select(NotificationPreference).where(NotificationPreference.user_id == user_id))
-    prefs = result.scalars().all()
-    pref_map = {p.channel: p.enabled for p in prefs}
-
-    response = {
-        "id": user.id,
-        "name": user.name,
-        "email": user.email,
-        "push_tokens": push_tokens,
-        "preferences": {"email": pref_map.get("email", True), "push": pref_map.get("push", True)}
-    }
-
-    # Cache safely
-    if redis:
-        try:
-            await redis.setex(f"user:{user.id}", 300, json.dumps(response))
-        except Exception as e:
-            logger.warning("Redis cache set failed: %s", e)
-
     return {
         "success": True,
         "data": response,
@@ -142,7 +296,12 @@ async def get_user(user_id: str, db: AsyncSession = Depends(get_db)):
 
 
 @router.put("/{user_id}/preferences")
-async def update_preferences(user_id: str, body: PreferenceUpdate, db: AsyncSession = Depends(get_db)):
+async def update_preferences(
+    user_id: str,
+    body: PreferenceUpdate,
+    db: AsyncSession = Depends(get_db),
+    redis = Depends(get_redis)
+):
     try:
         # Upsert preference
         result = await db.execute(
@@ -165,12 +324,8 @@ async def update_preferences(user_id: str, body: PreferenceUpdate, db: AsyncSess
             db.add(pref)
         await db.commit()
 
-        # Invalidate cache safely
-        if redis:
-            try:
-                await redis.delete(f"user:{user_id}")
-            except Exception as e:
-                logger.warning("Redis cache delete failed: %s", e)
+        # Invalidate cache on every replica (safe)
+        await invalidate_users(redis, [user_id])
 
         return {
             "success": True,
@@ -186,7 +341,12 @@ async def update_preferences(user_id: str, body: PreferenceUpdate, db: AsyncSess
 
 
 @router.post("/{user_id}/devices", status_code=201)
-async def register_device(user_id: str, body: DeviceCreate, db: AsyncSession = Depends(get_db)):
+async def register_device(
+    user_id: str,
+    body: DeviceCreate,
+    db: AsyncSession = Depends(get_db),
+    redis = Depends(get_redis)
+):
     try:
         # Deactivate any existing device with the same token
         await db.execute(
@@ -204,12 +364,8 @@ async def register_device(user_id: str, body: DeviceCreate, db: AsyncSession = D
         db.add(device)
         await db.commit()
 
-        # Invalidate Redis cache (optional, safe)
-        if redis:
-            try:
-                await redis.delete(f"user:{user_id}")
-            except Exception as e:
-                logger.warning("Redis cache delete failed: %s", e)
+        # Invalidate cache on every replica (optional, safe)
+        await invalidate_users(redis, [user_id])
 
         response = {
             "success": True,
@@ -228,3 +384,101 @@ async def register_device(user_id: str, body: DeviceCreate, db: AsyncSession = D
         await db.rollback()
         logger.exception("Register device failed: %s", e)
         raise HTTPException(status_code=500, detail="internal_error")
+
+
+@router.post("/devices/deactivate")
+async def deactivate_devices(
+    body: DeviceDeactivateBatch,
+    db: AsyncSession = Depends(get_db),
+    redis = Depends(get_redis)
+):
+    """Deactivate many device tokens (e.g. expired web push endpoints) in a single UPDATE."""
+    tokens = list(set(body.tokens))
+    try:
+        result = await db.execute(
+            update(Device)
+            .where(Device.device_token.in_(tokens), Device.is_active == True)
+            .values(is_active=False)
+            .returning(Device.user_id)
+            .execution_options(synchronize_session=False)
+        )
+        user_ids = [row[0] for row in result]
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        logger.exception("Bulk device deactivation failed: %s", e)
+        raise HTTPException(status_code=500, detail="internal_error")
+
+    # Invalidate cached profiles of affected users on every replica (optional, safe)
+    await invalidate_users(redis, set(user_ids))
+
+    return {
+        "success": True,
+        "data": {"requested": len(tokens), "deactivated": len(user_ids)},
+        "message": "Devices deactivated successfully",
+        "error": None,
+        "meta": None
+    }
+
+
+def _active_devices_query(platform: Optional[str], push_enabled: Optional[bool], user_ids: Optional[List[str]]):
+    query = select(Device.id, Device.user_id, Device.device_token, Device.platform).where(Device.is_active == True)
+    if platform:
+        query = query.where(Device.platform == platform)
+    if user_ids:
+        query = query.where(Device.user_id.in_(user_ids))
+    if push_enabled is not None:
+        # Users without a push preference row count as enabled (same default as get_user)
+        query = query.outerjoin(
+            NotificationPreference,
+            and_(NotificationPreference.user_id == Device.user_id, NotificationPreference.channel == "push"),
+        )
+        if push_enabled:
+            query = query.where(or_(NotificationPreference.enabled.is_(None), NotificationPreference.enabled == True))
+        else:
+            query = query.where(NotificationPreference.enabled == False)
+    return query
+
+
+@router.get("/devices/export")
+async def export_devices(
+    platform: Optional[str] = None,
+    push_enabled: Optional[bool] = None,
+    user_ids: Optional[List[str]] = Query(default=None),
+    after: Optional[str] = None
+):
+    """
+    Stream active devices as NDJSON, one device per line.
+    Pages are read with keyset pagination on devices.id through a
+    server-side cursor, so memory stays flat for any segment size.
+    Pass the last returned `id` as `after` to resume an interrupted export.
+    """
+    base_query = _active_devices_query(platform, push_enabled, user_ids)
+
+    async def stream_devices():
+        last_id = after
+        async with ReadSessionLocal() as session:
+            while True:
+                query = base_query
+                if last_id is not None:
+                    query = query.where(Device.id > last_id)
+                query = query.order_by(Device.id).limit(DEVICE_EXPORT_PAGE_SIZE)
+
+                result = await session.stream(query.execution_options(yield_per=500))
+                rows = 0
+                async for row in result:
+                    rows += 1
+                    last_id = row.id
+                    yield json.dumps({
+                        "id": row.id,
+                        "user_id": row.user_id,
+                        "device_token": row.device_token,
+                        "platform": row.platform
+                    }) + "\n"
+
+                # End the read transaction between pages
+                await session.rollback()
+                if rows < DEVICE_EXPORT_PAGE_SIZE:
+                    break
+
+    return StreamingResponse(stream_devices(), media_type="application/x-ndjson")
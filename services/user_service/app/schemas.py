@@ -32,6 +32,12 @@ class UserResponse(BaseModel):
 
     model_config = {"from_attributes": True}  # Pydantic v2 equivalent of orm_mode
 
+# ---------------------------
+# Batch User Lookup
+# ---------------------------
+class UserBatchRequest(BaseModel):
+    user_ids: List[str] = Field(..., min_length=1, max_length=1000)
+
 # ---------------------------
 # Device Registration
 # ---------------------------
@@ -39,6 +45,12 @@ class DeviceCreate(BaseModel):
     device_token: str
     platform: Optional[str] = "unknown"
 
+# ---------------------------
+# Bulk Device Deactivation
+# ---------------------------
+class DeviceDeactivateBatch(BaseModel):
+    tokens: List[str] = Field(..., min_length=1, max_length=10000)
+
 # ---------------------------
 # Preference Update
 # ---------------------------
@@ -1,4 +1,6 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 import uuid
@@ -9,12 +11,58 @@ load_dotenv()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "3600"))
 
+# bcrypt runs on a bounded thread pool (it releases the GIL) so it never blocks the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "4"))
+# Hash/verify calls allowed to queue for a worker before callers are rejected
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_pending = 0
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password hashing queue is full (backpressure)."""
+
+
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+async def _run_hasher(fn, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        raise PasswordHasherBusy()
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, fn, *args)
+    finally:
+        _hash_pending -= 1
+
+async def hash_password_async(password: str) -> str:
+    """Hash on the password worker pool; raises PasswordHasherBusy when saturated."""
+    return await _run_hasher(hash_password, password)
+
+async def hash_passwords_async(passwords: list[str]) -> list[str]:
+    """
+    Hash a batch of passwords (bulk imports) on the worker pool. Only one
+    hash per worker is queued at a time, so signups still get a worker
+    between them; the signup backpressure limit does not apply.
+    """
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+
+    async def hash_one(password: str) -> str:
+        async with slots:
+            return await loop.run_in_executor(_hash_executor, hash_password, password)
+
+    return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """Verify on the password worker pool; raises PasswordHasherBusy when saturated."""
+    return await _run_hasher(verify_password, plain, hashed)
+
 def gen_uuid() -> str:
     return str(uuid.uuid4())
 
@@ -0,0 +1,250 @@
+"""
+In-process load benchmark of the user_service hot endpoints.
+
+    python -m benchmarks.bench_endpoints --requests 2000 --concurrency 20 --output endpoints.json
+
+Run from services/user_service. Requests go through the real FastAPI app
+over httpx's ASGI transport, against SQLite (aiosqlite, a temp file by
+default) or --database-url (e.g. a local Postgres), with fakeredis unless
+--redis-url is given. Requires `aiosqlite` for SQLite and `fakeredis`
+without --redis-url.
+
+Per scenario it reports requests/sec, latency percentiles, non-2xx
+responses and SQL statements per request, so cache hit paths and
+N-query patterns show up directly.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class QueryCounter:
+    """Counts SQL statements executed on an engine."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *_):
+        self.count += 1
+
+
+async def seed_users(count: int) -> list[str]:
+    """Insert `count` users with one device and both preferences, reusing one password hash."""
+    from sqlalchemy import insert
+    from app.db import SessionLocal
+    from app.models import User, Device, NotificationPreference, gen_uuid
+    from app.utils import hash_password
+
+    password_hash = hash_password("benchmark-password")
+    user_ids = [gen_uuid() for _ in range(count)]
+    async with SessionLocal() as session:
+        for start in range(0, count, 500):
+            chunk = user_ids[start:start + 500]
+            await session.execute(insert(User), [
+                {"id": user_id, "name": f"Bench {user_id[:8]}", "email": f"{user_id}@example.com", "password": password_hash}
+                for user_id in chunk
+            ])
+            await session.execute(insert(Device), [
+                {"id": gen_uuid(), "user_id": user_id, "device_token": f"seed-{user_id}", "platform": "web", "is_active": True}
+                for user_id in chunk
+            ])
+            await session.execute(insert(NotificationPreference), [
+                {"id": gen_uuid(), "user_id": user_id, "channel": channel, "enabled": True}
+                for user_id in chunk
+                for channel in ("email", "push")
+            ])
+        await session.commit()
+    return user_ids
+
+
+def build_scenarios(user_ids: list[str], run_id: str):
+    """name -> (request count override or None, setup coroutine or None, request factory)."""
+    from app.cache import user_cache
+
+    def pick(i: int) -> str:
+        return user_ids[i % len(user_ids)]
+
+    async def warm_l1(client, redis):
+        user_cache.maxsize = len(user_ids)
+        for user_id in user_ids:
+            await client.get(f"/api/v1/users/{user_id}")
+
+    async def redis_only(client, redis):
+        # Every lookup misses the in-process cache and is served by Redis
+        user_cache.maxsize = 0
+        user_cache.clear()
+        for user_id in user_ids:
+            await client.get(f"/api/v1/users/{user_id}")
+
+    async def uncached(client, redis):
+        user_cache.maxsize = 0
+        user_cache.clear()
+        await redis.delete(*[f"user:{user_id}" for user_id in user_ids])
+
+    async def restore(client, redis):
+        user_cache.maxsize = int(os.getenv("USER_L1_CACHE_SIZE", "10000"))
+        user_cache.clear()
+
+    return {
+        "get_user_l1_hit": (None, warm_l1, lambda i: ("GET", f"/api/v1/users/{pick(i)}", None)),
+        "get_user_redis_hit": (None, redis_only, lambda i: ("GET", f"/api/v1/users/{pick(i)}", None)),
+        # One request per user, each a cold miss served by the DB
+        "get_user_uncached": (len(user_ids), uncached, lambda i: ("GET", f"/api/v1/users/{pick(i)}", None)),
+        "get_users_batch_100": (None, restore, lambda i: (
+            "POST", "/api/v1/users/batch", {"user_ids": [pick(i * 100 + k) for k in range(100)]}
+        )),
+        "create_user": ("create", None, lambda i: ("POST", "/api/v1/users/", {
+            "name": "Bench", "email": f"new-{run_id}-{i}@example.com", "password": "benchmark-password",
+            "push_token": f"new-{run_id}-{i}", "preferences": {"email": True, "push": True},
+        })),
+        "register_device": (None, None, lambda i: ("POST", f"/api/v1/users/{pick(i)}/devices", {
+            "device_token": f"dev-{run_id}-{i}", "platform": "web",
+        })),
+        "update_preferences": (None, None, lambda i: ("PUT", f"/api/v1/users/{pick(i)}/preferences", {
+            "channel": "push", "enabled": bool(i % 2),
+        })),
+        "update_status": (None, None, lambda i: ("POST", "/api/v1/push/status/", {
+            "notification_id": f"notif-{run_id}-{i}", "status": "delivered",
+        })),
+    }
+
+
+async def run_scenario(client, counter: QueryCounter, factory, requests: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            method, path, body = factory(index)
+            started = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 300:
+                errors += 1
+
+    queries_before = counter.count
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    # Let background cache refreshes settle so they are not billed to the next scenario
+    await asyncio.sleep(0.05)
+    queries = counter.count - queries_before
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "seconds": elapsed,
+        "requests_per_sec": requests / elapsed,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50) * 1000,
+            "p95": _percentile(latencies, 95) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+            "mean": statistics.fmean(latencies) * 1000,
+        },
+        "queries_per_request": queries / requests,
+    }
+
+
+async def bench(args) -> dict:
+    import httpx
+    import app.redis_client as redis_module
+    from app.main import app
+    from app.db import engine, Base
+    from app.cache import listen_for_invalidations
+
+    # ASGITransport does not run startup events, so do what startup does here
+    if args.redis_url:
+        redis = await redis_module.init_redis()
+    else:
+        import fakeredis
+        redis = redis_module.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    listener = asyncio.create_task(listen_for_invalidations(redis))
+
+    user_ids = await seed_users(args.users)
+    counter = QueryCounter(engine)
+    run_id = str(int(time.time()))
+    scenarios = build_scenarios(user_ids, run_id)
+    selected = args.scenarios or list(scenarios)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'scenario':<22}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'q/req':>8}{'errors':>8}")
+        for name in selected:
+            count, setup, factory = scenarios[name]
+            requests = args.create_requests if count == "create" else (count or args.requests)
+            if setup:
+                await setup(client, redis)
+            run = await run_scenario(client, counter, factory, requests, args.concurrency)
+            results[name] = run
+            latency = run["latency_ms"]
+            print(
+                f"{name:<22}{run['requests_per_sec']:>10.1f}{latency['p50']:>10.2f}{latency['p95']:>10.2f}"
+                f"{latency['p99']:>10.2f}{run['queries_per_request']:>8.2f}{run['errors']:>8}"
+            )
+
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+    await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--create-requests", type=int, default=100, help="create_user requests (bcrypt bound)")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--users", type=int, default=500, help="users seeded before the run")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), help="comma separated subset to run")
+    parser.add_argument("--database-url", help="default: a temporary SQLite file (aiosqlite)")
+    parser.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time
+    workdir = tempfile.mkdtemp(prefix="user-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir}/bench.db"
+    os.environ.pop("DATABASE_READ_URL", None)
+    os.environ["REDIS_URL"] = args.redis_url or "redis://unused"
+    import logging
+    logging.disable(logging.WARNING)
+
+    results = asyncio.run(bench(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "config": {
+                    "database": os.environ["DATABASE_URL"].split("://", 1)[0],
+                    "redis": "redis" if args.redis_url else "fakeredis",
+                    "users": args.users,
+                    "concurrency": args.concurrency,
+                    "python": sys.version.split()[0],
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()